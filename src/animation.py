@@ -0,0 +1,130 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+import codec
+from stream import StreamWriter
+
+
+def hsv_to_rgb(h, s: float = 1.0, v: float = 1.0) -> np.ndarray:
+    # vectorized colorsys.hsv_to_rgb for an array of hues, returns (N, 3) in 0..255
+    h = np.asarray(h, dtype=np.float64) % 1.0
+    k = (np.array([5, 3, 1]) + h[:, None] * 6) % 6
+    return (v - v * s * np.clip(np.minimum(k, 4 - k), 0, 1)) * 255
+
+
+class Animation(ABC):
+    # positions holds one value in [0, 1) per device, its place along the room
+    @abstractmethod
+    def render(self, t: float, positions: np.ndarray, out: np.ndarray):
+        pass
+
+
+class Solid(Animation):
+    def __init__(self, color: tuple):
+        self.color = np.asarray(color, dtype=np.float64)
+
+    def render(self, t, positions, out):
+        out[:] = self.color
+
+
+class Rainbow(Animation):
+    def __init__(self, period: float = 5.0, spread: float = 1.0):
+        self.period = period
+        self.spread = spread  # how much of the color wheel is spread across the devices
+
+    def render(self, t, positions, out):
+        out[:] = hsv_to_rgb(t / self.period + positions * self.spread)
+
+
+class Gradient(Animation):
+    def __init__(self, colors: list[tuple], period: float = 5.0):
+        self.colors = np.asarray(colors, dtype=np.float64)
+        self.period = period  # seconds for the gradient to move once along the room, 0 keeps it still
+        self.stops = np.linspace(0, 1, len(colors) + 1)
+        self.looped = np.vstack([self.colors, self.colors[:1]])
+
+    def render(self, t, positions, out):
+        x = (positions + t / self.period) % 1.0 if self.period else positions
+        for channel in range(3):
+            out[:, channel] = np.interp(x, self.stops, self.looped[:, channel])
+
+
+class Chase(Animation):
+    def __init__(self, color: tuple, background: tuple = (0, 0, 0), width: float = 0.2, period: float = 2.0):
+        self.color = np.asarray(color, dtype=np.float64)
+        self.background = np.asarray(background, dtype=np.float64)
+        self.width = width
+        self.period = period
+
+    def render(self, t, positions, out):
+        head = (t / self.period) % 1.0
+        distance = (head - positions) % 1.0
+        level = np.clip(1 - distance / self.width, 0, 1)[:, None]
+        out[:] = self.background + (self.color - self.background) * level
+
+
+class Transition(Animation):
+    def __init__(self, start: Animation, end: Animation, duration: float = 2.0):
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.scratch = None
+
+    def render(self, t, positions, out):
+        level = min(t / self.duration, 1.0) if self.duration else 1.0
+        if self.scratch is None or len(self.scratch) != len(out):
+            self.scratch = np.empty_like(out)
+        self.start.render(t, positions, out)
+        self.end.render(t, positions, self.scratch)
+        out *= 1 - level
+        out += self.scratch * level
+
+
+def fade(start: tuple, end: tuple, duration: float = 2.0) -> Transition:
+    return Transition(Solid(start), Solid(end), duration)
+
+
+class AnimationEngine:
+    def __init__(self, send, clients: list, animation: Animation, fps: float = 30.0):
+        self.send = send  # async send(client, frame) with a pre-encoded frame, e.g. ELKDevice.stream
+        self.clients = list(clients)
+        self.animation = animation
+        self.fps = fps
+        self.writer = None
+        self.rendered = 0
+        self.skipped = 0
+
+    async def run(self, duration: float = None):
+        period = 1.0 / self.fps
+        positions = np.arange(len(self.clients)) / max(len(self.clients), 1)
+        colors = np.zeros((len(self.clients), 3))
+        frames = np.empty((len(self.clients), codec.FRAME_SIZE), dtype=np.uint8)
+        self.writer = StreamWriter(self.send, adaptive=True)
+
+        start = time.monotonic()
+        frame = 0
+        try:
+            while duration is None or frame * period < duration:
+                delay = start + frame * period - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                self.animation.render(frame * period, positions, colors)
+                codec.colors(colors, frames)
+                for client, data in zip(self.clients, frames):
+                    self.writer.push(client, data.tobytes())
+                self.rendered += 1
+
+                # when the loop fell behind, jump to the frame that is due now instead of drifting
+                due = int((time.monotonic() - start) / period)
+                self.skipped += max(due - frame - 1, 0)
+                frame = max(frame + 1, due)
+        finally:
+            await self.writer.close()
+
+    def stats(self) -> dict:
+        devices = self.writer.stats() if self.writer is not None else {}
+        return {'rendered': self.rendered, 'skipped': self.skipped, 'devices': devices}
@@ -1,5 +1,4 @@
 import asyncio
-import pyaudio
 import numpy as np
 import colorsys
 
@@ -12,39 +11,176 @@ VOCAL_MAX = 2000
 INSTRUMENT_MAX = 20000
 
 
+class SpectrumAnalyzer:
+    def __init__(self, chunk_size: int = CHUNK_SIZE, rate: int = SR, window=None,
+                 bands: tuple = (BASS_MAX, VOCAL_MAX, INSTRUMENT_MAX)):
+        self.chunk_size = chunk_size
+        self.rate = rate
+        self.bins = chunk_size // 2  # use only the first half of the spectrum
+        frequencies = np.fft.rfftfreq(chunk_size, 1.0 / rate)[:self.bins]
+
+        # bands are contiguous, so each one is the slice between two bin edges
+        edges = np.searchsorted(frequencies, (0,) + tuple(bands))
+        self.lower = edges[:-1]
+        self.upper = edges[1:]
+        self.window = None if window is None else window(chunk_size)
+
+        self.samples = np.empty(chunk_size)
+        self.magnitude = np.empty(self.bins)
+        self.cumulative = np.zeros(self.bins + 1)
+        self.energy = np.empty(len(bands))
+        self.scratch = np.empty(len(bands))
+
+    def spectrum(self, audio_data) -> np.ndarray:
+        np.copyto(self.samples, audio_data)
+        if self.window is not None:
+            np.multiply(self.samples, self.window, out=self.samples)
+        np.abs(np.fft.rfft(self.samples)[:self.bins], out=self.magnitude)
+        return self.magnitude
+
+    def rgb(self, audio_data) -> tuple[int, int, int]:
+        self.spectrum(audio_data)
+        np.cumsum(self.magnitude, out=self.cumulative[1:])
+
+        total = self.cumulative[-1]
+        if total == 0 or np.isnan(total):
+            return 0, 0, 0
+
+        np.take(self.cumulative, self.upper, out=self.energy)
+        np.take(self.cumulative, self.lower, out=self.scratch)
+        self.energy -= self.scratch
+        self.energy *= 255 / total
+        return int(self.energy[0]), int(self.energy[1]), int(self.energy[2])
+
+    def spectrum_batch(self, chunks) -> np.ndarray:
+        chunks = np.asarray(chunks, dtype=np.float64)
+        if self.window is not None:
+            chunks = chunks * self.window
+        return np.abs(np.fft.rfft(chunks, axis=-1)[:, :self.bins])
+
+    def rgb_batch(self, chunks) -> np.ndarray:
+        return self.bands_batch(self.spectrum_batch(chunks))
+
+    def bands_batch(self, magnitude: np.ndarray) -> np.ndarray:
+        cumulative = np.zeros((len(magnitude), self.bins + 1))
+        np.cumsum(magnitude, axis=1, out=cumulative[:, 1:])
+
+        total = cumulative[:, -1:]
+        silent = (total[:, 0] == 0) | np.isnan(total[:, 0])
+        total[silent] = 1
+        rgb = (cumulative[:, self.upper] - cumulative[:, self.lower]) * 255 / total
+        rgb[silent] = 0
+        return rgb.astype(int)
+
+
+def hsv(h: float, s: float = 1.0, v: float = 1.0) -> tuple[float, float, float]:
+    r, g, b = colorsys.hsv_to_rgb(h % 1.0, s, v)
+    return r * 255, g * 255, b * 255
+
+
+class Zone:
+    # how one strip follows the spectrum: each band lights its palette color in proportion
+    # to its share of the spectrum, the default is the original bass/mids/highs to red/green/blue
+    palettes = {
+        'rgb': ((255, 0, 0), (0, 255, 0), (0, 0, 255)),
+    }
+
+    def __init__(self, bands: tuple = (BASS_MAX, VOCAL_MAX, INSTRUMENT_MAX), palette='rgb', gamma: float = 1.0,
+                 smoothing: float = 0.0):
+        self.bands = tuple(bands)  # upper edges in Hz, the first band starts at 0
+        self.palette = self.parse_palette(palette, len(self.bands))
+        self.gamma = gamma
+        self.smoothing = smoothing  # time constant in seconds, 0 follows every window
+
+    @classmethod
+    def parse_palette(cls, palette, count: int) -> np.ndarray:
+        # a palette is a name, or one color per band as [r, g, b] or {"h": .., "s": .., "v": ..}
+        if palette == 'rainbow':
+            colors = [hsv(i / count) for i in range(count)]
+        elif isinstance(palette, str):
+            if palette not in cls.palettes:
+                raise ValueError(f"Unknown palette: {palette}")
+            colors = cls.palettes[palette]
+        else:
+            colors = [hsv(color['h'], color.get('s', 1.0), color.get('v', 1.0)) if isinstance(color, dict)
+                      else tuple(color) for color in palette]
+        if len(colors) != count:
+            raise ValueError(f"Palette has {len(colors)} colors for {count} bands")
+        return np.array(colors, dtype=np.float64)
+
+    @classmethod
+    def from_dict(cls, config: dict) -> 'Zone':
+        return cls(**config)
+
+
+class ZoneMapper:
+    def __init__(self, zones: list[Zone], chunk_size: int = CHUNK_SIZE, rate: int = SR, interval: float = None):
+        bins = chunk_size // 2
+        frequencies = np.fft.rfftfreq(chunk_size, 1.0 / rate)[:bins]
+        # weights[3 * i + c, k] is what bin k adds to channel c of device i, so with the palettes folded
+        # in, a single product with the magnitude gives the color of every device
+        weights = np.zeros((len(zones), 3, bins))
+        for i, zone in enumerate(zones):
+            edges = np.searchsorted(frequencies, (0,) + zone.bands)
+            for lower, upper, color in zip(edges[:-1], edges[1:], zone.palette):
+                weights[i, :, lower:upper] += color[:, None]
+        self.weights = weights.reshape(-1, bins)
+
+        interval = interval or chunk_size / 2 / rate  # time between windows, the hop of Capture
+        self.alpha = np.array([[1 - np.exp(-interval / zone.smoothing) if zone.smoothing > 0 else 1.0]
+                               for zone in zones])
+        self.smoothed = bool((self.alpha != 1).any())
+        self.gamma = np.array([[zone.gamma] for zone in zones], dtype=np.float64)
+        self.curved = bool((self.gamma != 1).any())
+
+        self.linear = np.empty(len(zones) * 3)
+        self.state = np.zeros((len(zones), 3))
+        self.out = np.empty((len(zones), 3))
+
+    def __len__(self):
+        return len(self.state)
+
+    def update(self, magnitude: np.ndarray) -> np.ndarray:
+        # the returned array is reused by the next update
+        total = magnitude.sum()
+        if total == 0 or np.isnan(total):
+            self.linear[:] = 0
+        else:
+            np.dot(self.weights, magnitude, out=self.linear)
+            self.linear /= total
+        target = self.linear.reshape(-1, 3)
+
+        if self.smoothed:
+            self.state += self.alpha * (target - self.state)
+        else:
+            self.state[:] = target
+        np.clip(self.state, 0, 255, out=self.out)
+        if self.curved:
+            self.out /= 255
+            self.out **= self.gamma
+            self.out *= 255
+        return self.out
+
+
 class Audio:
     stream = None
+    analyzer = SpectrumAnalyzer()
 
     def get_audio(self):
         return np.frombuffer(self.stream.read(CHUNK_SIZE), dtype=np.int16)
 
     def open(self):
+        import pyaudio  # only needed for microphone capture
+
         p = pyaudio.PyAudio()
         self.stream = p.open(format=pyaudio.paInt16, channels=1, rate=SR, input=True, frames_per_buffer=CHUNK_SIZE)
 
     def close(self):
         self.stream.close()
 
-    @staticmethod
-    def audio_to_rgb(audio_data):
-        fourier = np.abs(np.fft.fft(audio_data)[:CHUNK_SIZE // 2])  # Use only first half of the fft output
-        frequencies = np.fft.fftfreq(len(audio_data), 1.0 / SR)[:CHUNK_SIZE // 2]
-
-        fourier_sum = fourier.sum()
-        if fourier_sum == 0 or np.isnan(fourier_sum):
-            return 0, 0, 0  # or handle this case however you want
-
-        # find the indices of the frequencies in the right bands
-        idx_bass = np.where(frequencies < BASS_MAX)[0]
-        idx_vocals = np.where((frequencies >= BASS_MAX) & (frequencies < VOCAL_MAX))[0]
-        idx_instruments = np.where((frequencies >= VOCAL_MAX) & (frequencies < INSTRUMENT_MAX))[0]
-
-        # sum the intensities in each band and normalize
-        red = int(fourier[idx_bass].sum() / fourier.sum() * 255)
-        green = int(fourier[idx_vocals].sum() / fourier.sum() * 255)
-        blue = int(fourier[idx_instruments].sum() / fourier.sum() * 255)
-
-        return red, green, blue
+    @classmethod
+    def audio_to_rgb(cls, audio_data):
+        return cls.analyzer.rgb(audio_data)
 
 
 async def test_audio():
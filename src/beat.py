@@ -0,0 +1,64 @@
+from collections import deque, namedtuple
+
+import numpy as np
+
+from audio import CHUNK_SIZE
+
+Beat = namedtuple('Beat', ['time', 'strength', 'bpm'])
+
+
+class BeatDetector:
+    def __init__(self, bins: int = CHUNK_SIZE // 2, history: int = 43, sensitivity: float = 1.5,
+                 min_interval: float = 0.25, tempo_window: int = 16, min_bpm: float = 70, max_bpm: float = 180):
+        self.previous = np.zeros(bins)
+        self.current = np.empty(bins)
+        self.flux = np.zeros(history)  # spectral flux of the last frames, used as the adaptive threshold
+        self.frames = 0
+        self.sensitivity = sensitivity
+        self.min_interval = min_interval
+        self.min_bpm = min_bpm
+        self.max_bpm = max_bpm
+        self.onsets = deque(maxlen=tempo_window)
+        self.last_flux = 0.0
+        self.bpm = None
+
+    def update(self, magnitude: np.ndarray, timestamp: float) -> Beat | None:
+        np.log1p(magnitude, out=self.current)
+        np.subtract(self.current, self.previous, out=self.previous)
+        np.maximum(self.previous, 0, out=self.previous)
+        flux = float(self.previous.sum())
+        self.previous, self.current = self.current, self.previous
+        return self.detect(flux, timestamp)
+
+    def detect(self, flux: float, timestamp: float) -> Beat | None:
+        # the onset picking on its own, for spectral flux that was computed elsewhere, e.g. for a whole file at once
+        threshold = self.flux.mean() + self.sensitivity * self.flux.std()
+        warm = self.frames >= len(self.flux)
+        self.flux[self.frames % len(self.flux)] = flux
+        self.frames += 1
+
+        rising = flux > self.last_flux
+        self.last_flux = flux
+        if not warm or not rising or flux <= threshold:
+            return None
+        if self.onsets and timestamp - self.onsets[-1] < self.min_interval:
+            return None
+
+        self.onsets.append(timestamp)
+        self.bpm = self.estimate_tempo()
+        return Beat(timestamp, flux / threshold if threshold > 0 else float('inf'), self.bpm)
+
+    def estimate_tempo(self) -> float | None:
+        if len(self.onsets) < 4:
+            return self.bpm
+        intervals = np.diff(self.onsets)
+        intervals = intervals[(intervals > 60 / (self.max_bpm * 2)) & (intervals < 60 / (self.min_bpm / 2))]
+        if len(intervals) == 0:
+            return self.bpm
+        bpm = 60 / float(np.median(intervals))
+        # fold double and half time into the expected range
+        while bpm < self.min_bpm:
+            bpm *= 2
+        while bpm > self.max_bpm:
+            bpm /= 2
+        return bpm
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import numpy as np
+
+from audio import BASS_MAX, CHUNK_SIZE, INSTRUMENT_MAX, SR, VOCAL_MAX, SpectrumAnalyzer, Zone, ZoneMapper
+
+
+def legacy_audio_to_rgb(audio_data):
+    fourier = np.abs(np.fft.fft(audio_data)[:CHUNK_SIZE // 2])
+    frequencies = np.fft.fftfreq(len(audio_data), 1.0 / SR)[:CHUNK_SIZE // 2]
+
+    fourier_sum = fourier.sum()
+    if fourier_sum == 0 or np.isnan(fourier_sum):
+        return 0, 0, 0
+
+    idx_bass = np.where(frequencies < BASS_MAX)[0]
+    idx_vocals = np.where((frequencies >= BASS_MAX) & (frequencies < VOCAL_MAX))[0]
+    idx_instruments = np.where((frequencies >= VOCAL_MAX) & (frequencies < INSTRUMENT_MAX))[0]
+
+    red = int(fourier[idx_bass].sum() / fourier.sum() * 255)
+    green = int(fourier[idx_vocals].sum() / fourier.sum() * 255)
+    blue = int(fourier[idx_instruments].sum() / fourier.sum() * 255)
+
+    return red, green, blue
+
+
+def synthetic_chunks(count: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(CHUNK_SIZE) / SR
+    frequencies = rng.uniform(40, 8000, (count, 3))
+    signal = np.sin(2 * np.pi * frequencies[:, :, None] * t).sum(axis=1)
+    signal += rng.normal(0, 0.3, signal.shape)
+    return (signal / 4 * 32767).astype(np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the legacy and precomputed spectral analysis.')
+    parser.add_argument('--chunks', type=int, default=5000)
+    parser.add_argument('--devices', type=int, default=32, help='strips with their own zone in the zone benchmark')
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+    analyzer = SpectrumAnalyzer()
+
+    def legacy():
+        for chunk in chunks:
+            legacy_audio_to_rgb(chunk)
+
+    def analyzer_rgb():
+        for chunk in chunks:
+            analyzer.rgb(chunk)
+
+    def batch():
+        analyzer.rgb_batch(chunks)
+
+    # a different zone per strip: one analyzer each, or one spectrum and the weight matrix
+    zones = [Zone((100 + 10 * i, 2000, 8000 + 100 * i), 'rainbow', gamma=2.2, smoothing=0.1)
+             for i in range(args.devices)]
+    analyzers = [SpectrumAnalyzer(bands=zone.bands) for zone in zones]
+    mapper = ZoneMapper(zones)
+
+    def per_device():
+        for chunk in chunks:
+            for device_analyzer in analyzers:
+                device_analyzer.rgb(chunk)
+
+    def zone_mapper():
+        for chunk in chunks:
+            mapper.update(analyzer.spectrum(chunk))
+
+    for name, func in (('legacy', legacy), ('analyzer', analyzer_rgb), ('analyzer batch', batch),
+                       (f'{args.devices} analyzers', per_device), (f'{args.devices} zones', zone_mapper)):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>15}: {args.chunks / elapsed:10.0f} chunks/s")
+
+
+if __name__ == '__main__':
+    main()
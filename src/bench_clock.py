@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+import numpy as np
+
+from clock import ClockSync
+from emulator import Fleet
+from registry import Registry
+
+
+def errors(fleet: Fleet) -> np.ndarray:
+    # how far each strip's clock is off, from the time it was set to and when the emulator applied it
+    offset = time.time() - time.monotonic()
+    result = []
+    for strip in fleet.strips.values():
+        hour, minute, second, _ = strip.time
+        applied = datetime.fromtimestamp(strip.updated + offset)
+        actual = applied.hour * 3600 + applied.minute * 60 + applied.second + applied.microsecond / 1e6
+        result.append(hour * 3600 + minute * 60 + second - actual)
+    return np.array(result)
+
+
+async def bench_time_now(fleet: Fleet, concurrency: int) -> np.ndarray:
+    # what `time now` used to do, one timestamp for everybody
+    device = fleet.device(concurrency)
+    await device.connect()
+    now = datetime.now()
+    await device.broadcast(device.set_time, now.hour, now.minute, now.second, now.weekday() + 1)
+    await device.disconnect()
+    return errors(fleet)
+
+
+async def bench_clock_sync(fleet: Fleet, concurrency: int, rounds: int) -> np.ndarray:
+    device = fleet.device(concurrency)
+    await device.connect()
+    clock = ClockSync(device, Registry('/nonexistent/clients.json'))
+    # the first rounds learn the latencies, like the syncs after connecting do
+    for _ in range(rounds):
+        await clock.sync()
+    await device.disconnect()
+    return errors(fleet)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='How far off the strip clocks are after setting the time.')
+    parser.add_argument('--size', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--spread', type=float, default=0.2, help='extra latency of the slowest strip')
+    parser.add_argument('--jitter', type=float, default=0.002)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    for name, bench in (('time now', lambda fleet: bench_time_now(fleet, args.concurrency)),
+                        ('clock sync', lambda fleet: bench_clock_sync(fleet, args.concurrency, args.rounds))):
+        fleet = Fleet(args.size, latency=args.latency, jitter=args.jitter, latency_spread=args.spread,
+                      connect_latency=0.01)
+        error = np.abs(await bench(fleet)) * 1000
+        print(f"{name:>10}: clock error mean {error.mean():6.1f} ms, p95 {np.percentile(error, 95):6.1f} ms, "
+              f"max {error.max():6.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import argparse
+import timeit
+
+import numpy as np
+
+import codec
+
+
+def legacy_color(r: int, g: int, b: int) -> bytes:
+    command = b'\x7e\x00\x05\x03'
+    command += bytes([r, g, b])
+    command += b'\x00\xef'
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare frame encoding with the codec against bytes concatenation.')
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--devices', type=int, default=128, help='rows per batch for the vectorized encoder')
+    args = parser.parse_args()
+
+    rgb = np.random.default_rng(0).integers(0, 256, (args.devices, 3))
+    values = rgb.tolist()
+    out = np.empty((args.devices, codec.FRAME_SIZE), dtype=np.uint8)
+    rounds = max(args.frames // args.devices, 1)
+    frames = rounds * args.devices
+
+    def concatenation():
+        for r, g, b in values:
+            legacy_color(r, g, b)
+
+    def templates():
+        for r, g, b in values:
+            codec.color(r, g, b)
+
+    def batch():
+        codec.colors(rgb, out)
+
+    for name, func in (('concatenation', concatenation), ('codec', templates), ('codec batch', batch)):
+        elapsed = timeit.timeit(func, number=rounds)
+        print(f"{name:>14}: {frames / elapsed / 1e6:6.2f} M frames/s, {elapsed / frames * 1e9:7.1f} ns/frame")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from audio import SpectrumAnalyzer
+from capture import Capture, SyntheticSource
+from elkble import ELKDevice
+from emulator import Fleet
+from stream import StreamWriter
+
+
+async def bench_connect(device: ELKDevice) -> float:
+    start = time.perf_counter()
+    results = await device.connect()
+    failed = sum(error is not None for _, error in results)
+    if failed:
+        print(f"    {failed} devices failed to connect")
+    return time.perf_counter() - start
+
+
+async def bench_broadcast(device: ELKDevice, commands: int) -> float:
+    start = time.perf_counter()
+    for i in range(commands):
+        await device.broadcast(device.set_color, i % 256, 0, 255 - i % 256)
+    return commands * len(device.clients) / (time.perf_counter() - start)
+
+
+async def bench_live(device: ELKDevice, duration: float) -> tuple[np.ndarray, int, int, float]:
+    latencies = []
+
+    async def send(client, r, g, b, captured):
+        written = await device.stream_color(client, r, g, b)
+        if written is not False:
+            # a frame the shadow suppressed never went out, it is counted as suppressed and not as a latency
+            latencies.append(time.monotonic() - captured)
+        return written
+
+    analyzer = SpectrumAnalyzer()
+    writer = StreamWriter(send, adaptive=True)
+    windows = 0
+    async with Capture(SyntheticSource(duration=duration, bpm=120)) as capture:
+        async for audio_data in capture.windows():
+            # the window is yielded as soon as its last sample arrives, so it was complete now
+            captured = time.monotonic()
+            writer.push_all(device.clients, *analyzer.rgb(audio_data), captured)
+            windows += 1
+    await asyncio.sleep(0.2)  # let the last frames land
+    await writer.close()
+    dropped = sum(stats['dropped'] for stats in writer.stats().values())
+    rate = np.mean([stats['rate'] for stats in writer.stats().values()])
+    return np.array(latencies), windows * len(device.clients), dropped, rate
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Benchmark ELKDevice against emulated ELK-BLEDOM strips.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 100, 500])
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per write')
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--disconnect-rate', type=float, default=0.0)
+    parser.add_argument('--connect-latency', type=float, default=0.1)
+    parser.add_argument('--capacity', type=float, default=None, help='writes per second each strip can take')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--commands', type=int, default=20)
+    parser.add_argument('--live-duration', type=float, default=2.0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        fleet = Fleet(size, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                      disconnect_rate=args.disconnect_rate, connect_latency=args.connect_latency,
+                      capacity=args.capacity)
+        device = fleet.device(args.concurrency)
+        connect = await bench_connect(device)
+        throughput = await bench_broadcast(device, args.commands)
+        latencies, frames, dropped, rate = await bench_live(device, args.live_duration)
+        shadow_stats = device.shadow_stats()
+        await device.disconnect()
+        p50, p99 = (np.percentile(latencies, (50, 99)) * 1000) if len(latencies) else (float('nan'),) * 2
+        print(f"{size:>4} strips: connect {connect * 1000:7.1f} ms, {throughput:8.0f} commands/s, "
+              f"live p50 {p50:6.1f} ms p99 {p99:6.1f} ms, dropped {dropped}/{frames} frames, "
+              f"mean rate {rate:5.1f}/s, "
+              f"suppressed {sum(stats['suppressed'] for stats in shadow_stats.values())}, "
+              f"lost {fleet.lost}, disconnects {fleet.disconnects}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import time
+
+import codec
+from elkble import CHARACTERISTIC_UUID, ManagedClient, Priority
+from emulator import Fleet
+from metrics import Histogram, metrics
+from stream import DeviceStream
+
+
+async def bench_writes(client: ManagedClient, writes: int) -> float:
+    # an emulated strip without latency, so the time is all bookkeeping on the write path
+    frame = codec.color(1, 2, 3)
+    start = time.perf_counter()
+    for i in range(writes):
+        await client.write_gatt_char(CHARACTERISTIC_UUID, frame, priority=Priority.stream if i % 2 else
+                                     Priority.control)
+    return (time.perf_counter() - start) / writes
+
+
+def bench_pushes(stream: DeviceStream, pushes: int) -> float:
+    start = time.perf_counter()
+    for i in range(pushes):
+        stream.push(i)
+    return (time.perf_counter() - start) / pushes
+
+
+def bench_observe(samples: int) -> float:
+    histogram = Histogram()
+    start = time.perf_counter()
+    for i in range(samples):
+        histogram.observe(i * 1e-6)
+    return (time.perf_counter() - start) / samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Measure what the metrics cost on the hot paths.')
+    parser.add_argument('--writes', type=int, default=50000)
+    args = parser.parse_args()
+
+    fleet = Fleet(1, latency=0.0, connect_latency=0.0)
+    address = next(iter(fleet.strips))
+    client = ManagedClient(address, fleet.client)
+    await client.connect()
+    stream = DeviceStream(client, None)
+
+    print(f"histogram observe: {bench_observe(args.writes) * 1e9:6.0f} ns")
+    results = {}
+    for enabled in (False, True, False, True):
+        metrics.enabled = enabled
+        # the second round of each counts, the first one warms up
+        results[enabled] = (await bench_writes(client, args.writes), bench_pushes(stream, args.writes))
+    metrics.enabled = True
+
+    for enabled, (write, push) in results.items():
+        print(f"{'enabled' if enabled else 'disabled':>9}: write {write * 1e6:6.2f} us, push {push * 1e9:5.0f} ns")
+    write_cost = (results[True][0] - results[False][0]) * 1e6
+    push_cost = (results[True][1] - results[False][1]) * 1e9
+    print(f"{'cost':>9}: write {write_cost:+6.2f} us, push {push_cost:+5.0f} ns")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from audio import Zone
+from capture import Capture, SyntheticSource
+from pipeline import Analysis, Input, Pipeline
+
+
+class CostlyAnalysis(Analysis):
+    # stands in for a finer FFT, more bands or another detector, burning a fixed amount of CPU per window
+    def __init__(self, zones: list[Zone], cost: float):
+        super().__init__(zones)
+        self.cost = cost
+
+    def analyze(self, samples: np.ndarray, timestamp: float, result: np.ndarray):
+        deadline = time.perf_counter() + self.cost
+        super().analyze(samples, timestamp, result)
+        while time.perf_counter() < deadline:
+            pass
+
+
+async def measure_lag(running: asyncio.Event, interval: float = 0.001) -> np.ndarray:
+    # how late a 1 ms timer fires is how long anything else on the loop, like BLE writes, would have waited
+    lags = []
+    while not running.is_set():
+        await asyncio.sleep(interval)
+    while running.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        if running.is_set():
+            lags.append(time.perf_counter() - start - interval)
+    return np.array(lags)
+
+
+async def in_loop(analyses: list[CostlyAnalysis], duration: float, running: asyncio.Event) -> int:
+    # what live mode does without the pipeline, every input analyzed on the event loop
+    results = np.zeros(1, dtype=[('time', '<f8'), ('beat', '<f8'), ('bpm', '<f8'), ('seconds', '<f8'),
+                                 ('colors', 'u1', (analyses[0].zones, 3))])
+    windows = 0
+
+    async def run(analysis: CostlyAnalysis, seed: int):
+        nonlocal windows
+        async with Capture(SyntheticSource(duration=duration, seed=seed)) as capture:
+            async for samples in capture.windows():
+                analysis.analyze(samples, capture.position, results[0])
+                windows += 1
+
+    running.set()
+    await asyncio.gather(*(run(analysis, seed) for seed, analysis in enumerate(analyses)))
+    running.clear()
+    return windows
+
+
+async def in_pipeline(analyses: list[CostlyAnalysis], duration: float, running: asyncio.Event) -> int:
+    inputs = [Input(SyntheticSource(duration=duration, seed=seed), [], analysis=analysis)
+              for seed, analysis in enumerate(analyses)]
+    async with Pipeline(inputs) as pipeline:
+        async for _ in pipeline.analyzed():
+            if not running.is_set() and all(pipeline.seen):
+                running.set()  # every worker is up, starting them is not what is measured
+        running.clear()
+    # the loop only takes the newest result of each input, the workers analyzed every window
+    return sum(pipeline.seen)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Event loop latency while audio is analyzed, on the loop and in '
+                                                 'worker processes, as the analysis gets more expensive.')
+    parser.add_argument('--inputs', type=int, default=2)
+    parser.add_argument('--zones', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--costs', type=float, nargs='+', default=(0.0, 2.0, 4.0, 8.0),
+                        help='extra analysis time per window in ms')
+    args = parser.parse_args()
+
+    for cost in args.costs:
+        for name, run in (('in loop', in_loop), ('pipeline', in_pipeline)):
+            analyses = [CostlyAnalysis([Zone()] * args.zones, cost / 1000) for _ in range(args.inputs)]
+            running = asyncio.Event()
+            lag = asyncio.create_task(measure_lag(running))
+            windows = await run(analyses, args.duration, running)
+            running.set()  # in case no window arrived at all
+            running.clear()
+            lags = await lag
+            p50, p99 = np.percentile(lags, (50, 99)) * 1000 if len(lags) else (float('nan'),) * 2
+            print(f"cost {cost:4.1f} ms {name:>9}: loop lag p50 {p50:5.2f} ms, p99 {p99:6.2f} ms, "
+                  f"max {lags.max() * 1000 if len(lags) else float('nan'):6.2f} ms, {windows} windows")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
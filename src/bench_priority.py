@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from emulator import Fleet
+
+
+async def run(args, lanes: bool) -> tuple[np.ndarray, int]:
+    fleet = Fleet(args.devices, latency=args.latency, jitter=args.latency / 4, connect_latency=0.01,
+                  capacity=args.capacity)
+    device = fleet.device()
+    device.pipelined = True
+    device.max_in_flight = args.senders
+    device.priority_lanes = lanes
+    await device.connect()
+
+    streamed = 0
+    running = True
+
+    async def saturate(client, offset: int):
+        # several producers per device push frames as fast as the link takes them
+        nonlocal streamed
+        i = offset
+        while running:
+            await device.stream_color(client, i % 256, (i * 7) % 256, (i * 13) % 256)
+            streamed += 1
+            i += args.senders
+
+    producers = [asyncio.create_task(saturate(client, offset))
+                 for client in device.clients for offset in range(args.senders)]
+    await asyncio.sleep(0.5)
+
+    latencies = []
+
+    async def control(client, level: int):
+        start = time.perf_counter()
+        await device.set_brightness(client, level)
+        latencies.append(time.perf_counter() - start)
+
+    for i in range(args.commands):
+        await device.fan_out(control, device.clients, 20 + i % 2)
+        await asyncio.sleep(args.interval)
+
+    running = False
+    await asyncio.gather(*producers, return_exceptions=True)
+    await device.disconnect()
+    return np.array(latencies), streamed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Control command latency while a saturating stream is running.')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--senders', type=int, default=4, help='stream producers per device')
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--capacity', type=float, default=30.0, help='writes per second each strip can take')
+    parser.add_argument('--commands', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    for lanes in (False, True):
+        latencies, streamed = await run(args, lanes)
+        p50, p99 = np.percentile(latencies, (50, 99)) * 1000
+        print(f"priority lanes {'on ' if lanes else 'off'}: control p50 {p50:7.1f} ms, p99 {p99:7.1f} ms, "
+              f"{streamed} stream frames sent")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import time
+
+from emulator import Fleet
+from scenes import Plan, settings_frames
+
+SCENE = {'power': 'on', 'color': [255, 120, 0], 'brightness': 80, 'speed': 50}
+
+
+async def bench_commands(device) -> float:
+    # what typing the scene at the prompt does, one broadcast after the other
+    start = time.perf_counter()
+    await device.broadcast(device.power_on)
+    await device.broadcast(device.set_color, *SCENE['color'])
+    await device.broadcast(device.set_brightness, SCENE['brightness'])
+    await device.broadcast(device.set_effect_speed, SCENE['speed'])
+    return time.perf_counter() - start
+
+
+async def bench_plan(device) -> float:
+    start = time.perf_counter()
+    plan = Plan()
+    addresses = [client.address for client in device.clients]
+    for frame in settings_frames(SCENE):
+        plan.add(addresses, frame)
+    results = await plan.apply(device)
+    failed = sum(error is not None for _, error in results)
+    if failed:
+        print(f"    {failed} devices failed")
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Switch a room of emulated strips to a scene.')
+    parser.add_argument('--size', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.03, help='seconds per write')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    for name, bench in (('commands', bench_commands), ('scene', bench_plan)):
+        fleet = Fleet(args.size, latency=args.latency, connect_latency=0.0)
+        device = fleet.device(args.concurrency)
+        await device.connect()
+        elapsed = await bench(device)
+        await device.disconnect()
+        print(f"{name:>9}: {elapsed * 1000:7.1f} ms, {elapsed / args.latency:5.1f} round trips")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
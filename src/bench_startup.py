@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# modules the one-shot command path must not load
+HEAVY = ('numpy', 'prompt_toolkit', 'pyaudio')
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import': elapsed, 'heavy': [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+
+def import_times(module: str, top: int) -> list[tuple[int, str]]:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=HERE, capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # import time: <self us> | <cumulative us> | <module>
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.rstrip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Measure how long the one-shot command path takes to start.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    parser.add_argument('--budget', type=float, default=None, help='fail if importing main takes longer (ms)')
+    args = parser.parse_args()
+
+    samples = []
+    heavy = set()
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', PROBE], cwd=HERE, capture_output=True, text=True, check=True)
+        wall = time.perf_counter() - start
+        probe = json.loads(output.stdout)
+        samples.append((probe['import'], wall))
+        heavy.update(probe['heavy'])
+
+    imports, walls = zip(*samples)
+    print(f"import main: best {min(imports) * 1000:.1f} ms, interpreter + import: best {min(walls) * 1000:.1f} ms")
+    print("slowest imports (cumulative us):")
+    for cumulative, name in import_times('main', args.top):
+        print(f"  {cumulative:>8}  {name}")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: the one-shot path imports {', '.join(sorted(heavy))}")
+        failed = True
+    if args.budget is not None and min(imports) * 1000 > args.budget:
+        print(f"FAIL: importing main takes more than {args.budget} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import sys
+
+import numpy as np
+
+from emulator import Fleet
+from presentation import Synchronizer
+
+
+async def bench_skew(fleet: Fleet, concurrency: int, frames: int, synchronizer: Synchronizer = None) -> np.ndarray:
+    # skew of a frame is how far apart the first and the last strip applied it, as the emulator saw it
+    device = fleet.device(concurrency)
+    device.synchronizer = synchronizer
+    await device.connect()
+    skews = []
+    for i in range(frames):
+        await device.broadcast(device.set_color, i % 256, 0, 255 - i % 256)
+        updated = [strip.updated for strip in fleet.strips.values()]
+        skews.append(max(updated) - min(updated))
+        await asyncio.sleep(0.02)
+    await device.disconnect()
+    return np.array(skews)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description='Measure how far apart the strips show a broadcast change.')
+    parser.add_argument('--size', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per write of the fastest strip')
+    parser.add_argument('--spread', type=float, default=0.05, help='extra latency of the slowest strip')
+    parser.add_argument('--jitter', type=float, default=0.001)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--window', type=float, default=0.01, help='skew the synchronized mode aims for')
+    parser.add_argument('--required', type=float, default=0.75,
+                        help='share of synchronized frames that have to be within the window')
+    args = parser.parse_args()
+
+    results = {}
+    for name, synchronizer in (('fan out', None), ('synchronized', Synchronizer(args.window))):
+        fleet = Fleet(args.size, latency=args.latency, jitter=args.jitter, latency_spread=args.spread,
+                      connect_latency=0.01)
+        skews = await bench_skew(fleet, args.concurrency, args.frames, synchronizer)
+        # the synchronizer learns the latencies from the first frames
+        skews = skews[len(skews) // 5:] if synchronizer is not None else skews
+        results[name] = skews
+        p50, p95 = np.percentile(skews, (50, 95)) * 1000
+        print(f"{name:>12}: skew p50 {p50:6.1f} ms, p95 {p95:6.1f} ms, max {skews.max() * 1000:6.1f} ms, "
+              f"{np.mean(skews <= args.window):4.0%} within the window")
+        if synchronizer is not None:
+            stats = synchronizer.stats()
+            print(f"{'':>12}  measured by the synchronizer: p50 {stats['skew_p50'] * 1000:6.1f} ms, "
+                  f"p95 {stats['skew_p95'] * 1000:6.1f} ms, {stats['late']}/{stats['frames']} frames late")
+
+    within = np.mean(results['synchronized'] <= args.window)
+    if within < args.required:
+        print(f"only {within:.0%} of the synchronized frames are within {args.window * 1000:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
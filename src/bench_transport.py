@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+from elkble import CHARACTERISTIC_UUID, ELKDevice, PipelinedClient
+
+
+class FakeCharacteristic:
+    def __init__(self, uuid: str, properties: list[str]):
+        self.uuid = uuid
+        self.properties = properties
+
+
+class FakeServices:
+    def __init__(self, characteristics: list[FakeCharacteristic]):
+        self.characteristics = characteristics
+
+    def get_characteristic(self, uuid: str):
+        # bleak resolves UUIDs with a linear scan over every characteristic of the device
+        for characteristic in self.characteristics:
+            if characteristic.uuid == str(uuid).lower():
+                return characteristic
+        return None
+
+
+class FakeClient:
+    def __init__(self, address: str, latency: float = 0.01, response_latency: float = 0.02, buffer: int = 8,
+                 characteristics: int = 32):
+        self.address = address
+        self.latency = latency
+        self.response_latency = response_latency
+        self.buffer = buffer
+        self.in_flight = 0
+        self.overflows = 0
+        self.writes = 0
+        filler = [FakeCharacteristic(f'0000{i:04x}-0000-1000-8000-00805f9b34fb', ['read'])
+                  for i in range(characteristics)]
+        self.services = FakeServices(filler + [
+            FakeCharacteristic(CHARACTERISTIC_UUID, ['write-without-response', 'write'])])
+
+    async def connect(self):
+        return True
+
+    async def disconnect(self):
+        return True
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = False):
+        if not isinstance(char_specifier, FakeCharacteristic):
+            char_specifier = self.services.get_characteristic(char_specifier)
+        if self.in_flight >= self.buffer:
+            # the adapter has no slot left and discards the write, the host does not find out
+            self.overflows += 1
+            await asyncio.sleep(self.latency)
+            return
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency + (self.response_latency if response else 0))
+        finally:
+            self.in_flight -= 1
+        self.writes += 1
+
+
+async def run_mode(client, commands: int, senders: int) -> tuple[float, np.ndarray]:
+    latencies = np.empty(commands)
+    counter = iter(range(commands))
+
+    async def sender():
+        for i in counter:
+            start = time.perf_counter()
+            await ELKDevice.set_color(client, i % 256, 0, 0)
+            latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(senders)))
+    return time.perf_counter() - start, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Compare the default and pipelined write transports.')
+    parser.add_argument('--commands', type=int, default=500)
+    parser.add_argument('--senders', type=int, default=8, help='concurrent producers per device')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds per write')
+    parser.add_argument('--response-latency', type=float, default=0.015, help='extra seconds for an ATT response')
+    parser.add_argument('--buffer', type=int, default=8, help='adapter write buffer slots')
+    parser.add_argument('--in-flight', type=int, default=None, help='pipelined writes in flight, defaults to --buffer')
+    args = parser.parse_args()
+
+    def fake():
+        return FakeClient('00:00:00:00:00:00', args.latency, args.response_latency, args.buffer)
+
+    # both transports with a single producer, which awaits each command before sending the next one, with
+    # --senders producers and with more producers than the adapter has buffer slots, each configuration the same
+    # for both. Only commands that reached the strip count, the ones the adapter discarded are reported as lost
+    for senders in sorted({1, args.senders, 2 * args.buffer}):
+        for name in ('default', 'pipelined'):
+            fake_client = fake()
+            client = fake_client
+            if name == 'pipelined':
+                client = PipelinedClient(fake_client, args.in_flight or args.buffer)
+                await client.connect()
+            elapsed, latencies = await run_mode(client, args.commands, senders)
+            print(f"{name:>10}, {senders:>2} senders: {fake_client.writes / elapsed:8.1f} commands/s delivered, "
+                  f"p50 {np.percentile(latencies, 50) * 1000:6.2f} ms, "
+                  f"p99 {np.percentile(latencies, 99) * 1000:6.2f} ms, lost {fake_client.overflows}/{args.commands}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
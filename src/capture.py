@@ -0,0 +1,227 @@
+import asyncio
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from audio import CHUNK_SIZE, SR
+from metrics import metrics
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, dtype=np.int16):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=dtype)
+        # total number of samples ever written, only the producer updates it and only after the copy is done
+        self.written = 0
+
+    def write(self, samples: np.ndarray):
+        samples = samples[-self.capacity:]
+        start = self.written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self.data[start:start + first] = samples[:first]
+        self.data[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def read(self, position: int, out: np.ndarray):
+        start = position % self.capacity
+        first = min(len(out), self.capacity - start)
+        out[:first] = self.data[start:start + first]
+        out[first:] = self.data[:len(out) - first]
+
+
+class MicrophoneSource:
+    def __init__(self, rate: int = SR, block: int = CHUNK_SIZE, device: int = None):
+        self.rate = rate
+        self.block = block
+        self.device = device  # PyAudio input device index, None is the default input
+        self.pyaudio = None
+        self.stream = None
+
+    def start(self, callback, on_end):
+        import pyaudio  # only needed for microphone capture
+
+        def stream_callback(in_data, frame_count, time_info, status):
+            callback(np.frombuffer(in_data, dtype=np.int16))
+            return None, pyaudio.paContinue
+
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = self.pyaudio.open(format=pyaudio.paInt16, channels=1, rate=self.rate, input=True,
+                                        frames_per_buffer=self.block, input_device_index=self.device,
+                                        stream_callback=stream_callback)
+
+    def stop(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.pyaudio.terminate()
+
+
+class ThreadSource(ABC):
+    block = CHUNK_SIZE
+    rate = SR
+    realtime = True
+
+    def __init__(self):
+        self.thread = None
+        self.running = False
+
+    @abstractmethod
+    def blocks(self):
+        # yields the samples block by block, the thread stops at the end
+        pass
+
+    def start(self, callback, on_end):
+        def run():
+            interval = self.block / self.rate
+            deadline = time.monotonic()
+            for samples in self.blocks():
+                if not self.running:
+                    return
+                callback(samples)
+                if self.realtime:
+                    deadline += interval
+                    time.sleep(max(deadline - time.monotonic(), 0))
+            on_end()
+
+        self.running = True
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+class WavSource(ThreadSource):
+    def __init__(self, path: str, block: int = CHUNK_SIZE, realtime: bool = True, repeat: bool = False):
+        super().__init__()
+        self.path = path
+        self.block = block
+        self.realtime = realtime
+        self.repeat = repeat
+        with wave.open(path, 'rb') as wav:
+            self.rate = wav.getframerate()
+
+    @staticmethod
+    def to_mono(frames: bytes, sample_width: int, channels: int) -> np.ndarray:
+        if sample_width == 1:
+            samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8
+        elif sample_width == 2:
+            samples = np.frombuffer(frames, dtype=np.int16)
+        elif sample_width == 4:
+            samples = (np.frombuffer(frames, dtype=np.int32) >> 16).astype(np.int16)
+        else:
+            raise ValueError(f"Unsupported WAV sample width: {sample_width}")
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        return samples
+
+    def blocks(self):
+        while True:
+            with wave.open(self.path, 'rb') as wav:
+                while True:
+                    frames = wav.readframes(self.block)
+                    if not frames:
+                        break
+                    yield self.to_mono(frames, wav.getsampwidth(), wav.getnchannels())
+            if not self.repeat:
+                return
+
+
+class SyntheticSource(ThreadSource):
+    def __init__(self, frequencies: tuple = (100, 1000, 5000), rate: int = SR, block: int = CHUNK_SIZE,
+                 realtime: bool = True, noise: float = 0.1, duration: float = None, seed: int = 0,
+                 bpm: float = None):
+        super().__init__()
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.bpm = bpm  # when set, the tones pulse with a decaying envelope on every beat
+        self.rate = rate
+        self.block = block
+        self.realtime = realtime
+        self.noise = noise
+        self.duration = duration
+        self.rng = np.random.default_rng(seed)
+
+    def blocks(self):
+        total = None if self.duration is None else int(self.duration * self.rate)
+        position = 0
+        scale = 32767 / (len(self.frequencies) + 3 * self.noise)
+        while total is None or position < total:
+            t = (position + np.arange(self.block)) / self.rate
+            signal = np.sin(2 * np.pi * self.frequencies[:, None] * t).sum(axis=0)
+            if self.bpm is not None:
+                signal *= np.exp(-(t % (60 / self.bpm)) * 20)
+            signal += self.rng.normal(0, self.noise, self.block)
+            yield (signal * scale).astype(np.int16)
+            position += self.block
+
+
+class Capture:
+    def __init__(self, source, window: int = CHUNK_SIZE, hop: int = CHUNK_SIZE // 2, capacity: int = None):
+        self.source = source
+        self.window = window
+        self.hop = hop
+        self.buffer = RingBuffer(capacity or window * 16)
+        self.output = np.empty(window, dtype=np.int16)
+        self.ready = asyncio.Event()
+        self.finished = False
+        self.overruns = 0
+        self.position = 0  # sample index of the window that was yielded last
+        self.wait_histogram = metrics.histogram('capture_wait_seconds')
+        self.overrun_counter = metrics.counter('capture_overruns_total')
+        self.loop = None
+
+    def notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            pass  # the event loop is already closed
+
+    def on_samples(self, samples: np.ndarray):
+        self.buffer.write(samples)
+        self.notify()
+
+    def on_end(self):
+        self.finished = True
+        self.notify()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.source.start(self.on_samples, self.on_end)
+
+    def stop(self):
+        self.source.stop()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.stop()
+
+    async def windows(self):
+        # the yielded array is reused for the next window, copy it if it has to outlive the iteration
+        position = 0
+        while True:
+            while self.buffer.written - position < self.window:
+                if self.finished:
+                    return
+                self.ready.clear()
+                if self.buffer.written - position < self.window:
+                    waiting = time.perf_counter()
+                    await self.ready.wait()
+                    if metrics.enabled:
+                        self.wait_histogram.observe(time.perf_counter() - waiting)
+
+            if self.buffer.written - position > self.buffer.capacity - self.window:
+                # the producer lapped us, continue from the newest full window
+                self.overruns += 1
+                if metrics.enabled:
+                    self.overrun_counter.inc()
+                position = self.buffer.written - self.window
+            self.buffer.read(position, self.output)
+            self.position = position
+            position += self.hop
+            yield self.output
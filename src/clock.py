@@ -0,0 +1,127 @@
+import asyncio
+import math
+import time
+from datetime import datetime
+
+import codec
+from elkble import CHARACTERISTIC_UUID, Days, ELKDevice
+from presentation import Synchronizer
+
+KINDS = {'on': 'schedule_on', 'off': 'schedule_off'}
+
+
+def parse_days(days) -> bytes:
+    # a name of Days, e.g. "week_days", or a list of them
+    names = [days] if isinstance(days, str) else days
+    try:
+        return bytes([sum(Days.from_string(name)[0] for name in names) & 0x7f])
+    except AttributeError:
+        raise ValueError(f"Unknown days {days}, possible days: {Days.to_list()}") from None
+
+
+def schedule_frame(kind: str, entry: dict) -> bytes:
+    # {"days": "week_days", "at": "07:30", "enabled": true}
+    hour, minute = (int(part) for part in entry['at'].split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time {entry['at']}")
+    return codec.schedule(kind == 'on', parse_days(entry.get('days', 'all')), hour, minute,
+                          entry.get('enabled', True))
+
+
+class ClockSync:
+    # Keeps the clocks of the strips and the schedules of clients.json on them. A strip that lost power forgets
+    # both, so every (re)connect syncs it again, and the clocks are set again periodically since they drift.
+    # Each strip is sent the time early by its measured write latency so that it arrives on a second boundary.
+    def __init__(self, device: ELKDevice, registry, interval: float = 3600.0, refresh=None, check: float = 5.0):
+        self.device = device
+        self.registry = registry
+        self.refresh = refresh or registry.refresh  # re-reads clients.json if it changed on disk
+        self.interval = interval  # seconds between clock syncs
+        self.check = check  # seconds between looks at clients.json for changed schedules
+        self.latency = Synchronizer()  # only its latency estimates are used
+        self.synced: dict[str, float] = {}  # address -> wall clock time the strip was last set to
+        self.pushed: dict[str, dict[str, bytes]] = {}  # address -> schedule frames the strip has
+        self.pending: dict[str, asyncio.Task] = {}
+        self.task = None
+
+    def desired(self, address: str) -> dict[str, bytes]:
+        schedule = self.registry.schedule(address)
+        frames = {KINDS[kind]: schedule_frame(kind, entry) for kind, entry in schedule.items() if kind in KINDS}
+        # a schedule that was removed from the config is switched off rather than left running
+        for kind in self.pushed.get(address, {}):
+            if kind not in frames:
+                frames[kind] = codec.schedule(kind == 'schedule_on', Days.none, 0, 0, False)
+        return frames
+
+    async def stamp(self, client):
+        latency = self.latency.estimate(client.address)
+        # the next whole second that can still be reached, the strip's clock only has seconds
+        boundary = math.ceil(time.time() + latency + 0.05)
+        await self.latency.sleep_until(time.monotonic() + boundary - latency - time.time())
+        now = datetime.fromtimestamp(boundary)
+        sent = time.monotonic()
+        await ELKDevice.set_time(client, now.hour, now.minute, now.second, now.weekday() + 1)
+        self.latency.observe(client.address, time.monotonic() - sent)
+        self.synced[client.address] = boundary
+
+    async def push(self, client):
+        pushed = self.pushed.setdefault(client.address, {})
+        for kind, frame in self.desired(client.address).items():
+            if pushed.get(kind) != frame:
+                pushed.pop(kind, None)
+                await client.write_gatt_char(CHARACTERISTIC_UUID, frame)
+                pushed[kind] = frame
+
+    async def sync_client(self, client):
+        await self.stamp(client)
+        await self.push(client)
+
+    async def sync(self, clients: list = None, stamp: bool = True,
+                   push: bool = True) -> list[tuple[object, Exception | None]]:
+        # all strips at once, each one waits for its own moment to send the time. Not through the synchronizer,
+        # the stamps already make up for their latency and their waits would end up in its latency estimates
+        clients = [client for client in (self.device.clients if clients is None else clients)
+                   if client.state == 'connected']
+        func = self.sync_client if stamp and push else self.stamp if stamp else self.push
+        return await self.device.fan_out(func, clients, concurrency=max(len(clients), 1))
+
+    def connected(self, client):
+        # called by the device for every connect and reconnect, the strip may have been without power
+        self.pushed.pop(client.address, None)
+        task = self.pending.get(client.address)
+        if task is None or task.done():
+            self.pending[client.address] = asyncio.create_task(self.device.fan_out(self.sync_client, [client]))
+
+    async def run(self):
+        await self.sync()
+        last, mtime = time.monotonic(), self.registry.mtime
+        while True:
+            await asyncio.sleep(self.check)
+            try:
+                self.refresh()
+            except (ValueError, KeyError):
+                pass  # an invalid clients.json keeps the schedules that were pushed
+            if time.monotonic() - last >= self.interval:
+                await self.sync()
+                last = time.monotonic()
+            elif self.registry.mtime != mtime:
+                await self.sync(stamp=False)
+            mtime = self.registry.mtime
+
+    def start(self):
+        self.device.clock = self
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.device.clock = None
+        tasks = [task for task in [self.task, *self.pending.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+        self.pending.clear()
+
+    def stats(self) -> dict[str, dict]:
+        return {address: {'synced': synced, 'latency': self.latency.estimate(address),
+                          'schedules': sorted(self.pushed.get(address, {}))}
+                for address, synced in self.synced.items()}
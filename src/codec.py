@@ -0,0 +1,114 @@
+# every ELK-BLEDOM frame is 9 bytes: 0x7e 0x00 <opcode> <5 payload bytes> <end>
+FRAME_SIZE = 9
+
+POWER = 0x04
+BRIGHTNESS = 0x01
+SPEED = 0x02
+MODE = 0x03
+COLOR = 0x05
+SCHEDULE = 0x82
+TIME = 0x83
+
+MODE_EFFECT = 0x03
+MODE_DYNAMIC = 0x04
+
+_power_on = b'\x7e\x00\x04\xf0\x00\x01\xff\x00\xef'
+_power_off = b'\x7e\x00\x04\x00\x00\x00\xff\x00\xee'
+_brightness = bytearray(b'\x7e\x00\x01\x00\x00\x00\x00\x00\xef')
+_speed = bytearray(b'\x7e\x00\x02\x00\x00\x00\x00\x00\xef')
+_mode = bytearray(b'\x7e\x00\x03\x00\x00\x00\x00\x00\xef')
+_color = bytearray(b'\x7e\x00\x05\x03\x00\x00\x00\x00\xef')
+_time = bytearray(b'\x7e\x00\x83\x00\x00\x00\x00\x00\xef')
+_schedule = bytearray(b'\x7e\x00\x82\x00\x00\x00\x00\x00\xef')
+_color_template = bytes(_color)
+
+
+def _value(value) -> int:
+    # Effects, DynamicModes and Days hold single byte values
+    return value[0] if isinstance(value, (bytes, bytearray)) else value
+
+
+def power(on: bool) -> bytes:
+    return _power_on if on else _power_off
+
+
+def brightness(value: int) -> bytes:
+    _brightness[3] = min(value, 0x64)
+    return bytes(_brightness)
+
+
+def speed(value: int) -> bytes:
+    _speed[3] = value
+    return bytes(_speed)
+
+
+def effect(value) -> bytes:
+    _mode[3] = _value(value)
+    _mode[4] = MODE_EFFECT
+    return bytes(_mode)
+
+
+def dynamic(value) -> bytes:
+    _mode[3] = _value(value)
+    _mode[4] = MODE_DYNAMIC
+    return bytes(_mode)
+
+
+def color(r: int, g: int, b: int) -> bytes:
+    _color[4] = r
+    _color[5] = g
+    _color[6] = b
+    return bytes(_color)
+
+
+def time(hour: int, minute: int, second: int, day_of_week: int) -> bytes:
+    _time[3] = hour
+    _time[4] = minute
+    _time[5] = second
+    _time[6] = day_of_week
+    return bytes(_time)
+
+
+def schedule(on: bool, days, hour: int, minute: int, enable: bool) -> bytes:
+    _schedule[3] = hour
+    _schedule[4] = minute
+    _schedule[6] = 0x00 if on else 0x01
+    _schedule[7] = _value(days) | 0x80 if enable else _value(days)
+    return bytes(_schedule)
+
+
+def colors(rgb, out=None):
+    import numpy as np  # only the batch API needs NumPy, keep it off the one-shot command path
+
+    rgb = np.asarray(rgb)
+    if out is None:
+        out = np.empty((len(rgb), FRAME_SIZE), dtype=np.uint8)
+    out[:] = np.frombuffer(_color_template, dtype=np.uint8)
+    out[:, 4:7] = np.clip(rgb, 0, 255)
+    return out
+
+
+def decode(frame) -> tuple[str, tuple]:
+    frame = bytes(frame)
+    if len(frame) != FRAME_SIZE or frame[0] != 0x7e or frame[-1] not in (0xef, 0xee):
+        raise ValueError(f"Not an ELK-BLEDOM frame: {frame.hex()}")
+
+    opcode = frame[2]
+    if opcode == POWER:
+        return 'power', (frame[3] == 0xf0,)
+    elif opcode == BRIGHTNESS:
+        return 'brightness', (frame[3],)
+    elif opcode == SPEED:
+        return 'speed', (frame[3],)
+    elif opcode == MODE and frame[4] == MODE_EFFECT:
+        return 'effect', (frame[3],)
+    elif opcode == MODE and frame[4] == MODE_DYNAMIC:
+        return 'dynamic', (frame[3],)
+    elif opcode == COLOR and frame[3] == 0x03:
+        return 'color', (frame[4], frame[5], frame[6])
+    elif opcode == TIME:
+        return 'time', (frame[3], frame[4], frame[5], frame[6])
+    elif opcode == SCHEDULE:
+        name = 'schedule_on' if frame[6] == 0x00 else 'schedule_off'
+        return name, (frame[7] & 0x7f, frame[3], frame[4], bool(frame[7] & 0x80))
+    raise ValueError(f"Unknown ELK-BLEDOM command: {frame.hex()}")
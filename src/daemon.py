@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+
+from main import CLI
+from metrics import metrics
+
+
+def default_socket() -> str:
+    runtime = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime, f'elkble-{os.getuid()}.sock')
+
+
+class Daemon:
+    def __init__(self, cli: CLI):
+        self.cli = cli
+        self.lock = asyncio.Lock()  # commands run one at a time, like at the prompt
+        self.stopped = asyncio.Event()
+
+    async def execute(self, command: str) -> dict:
+        result = {'command': command, 'output': '', 'error': None}
+        if command.split()[:1] == ['exit']:
+            self.stopped.set()
+            return result
+        output = io.StringIO()
+        async with self.lock:
+            try:
+                await self.cli.process_command(command, output)
+            except Exception as e:
+                result['error'] = repr(e)
+        result['output'] = output.getvalue()
+        return result
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # one JSON request per line: {"commands": ["power on", "color 255 0 0"]}
+        try:
+            while line := await reader.readline():
+                try:
+                    commands = json.loads(line)['commands']
+                    if not isinstance(commands, list) or not all(isinstance(command, str) for command in commands):
+                        raise TypeError("commands must be a list of strings")
+                    response = {'results': [await self.execute(command) for command in commands]}
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {'error': f"Invalid request: {e!r}"}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def claim(socket_path: str):
+        # a socket left behind by a daemon that died is removed, one that still answers belongs to a running daemon
+        try:
+            _, writer = await asyncio.open_unix_connection(socket_path)
+        except FileNotFoundError:
+            return
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+            return
+        writer.close()
+        raise SystemExit(f"Another elkble daemon is serving {socket_path}")
+
+    async def serve(self, socket_path: str = None, host: str = None, port: int = None):
+        if port is not None:
+            server = await asyncio.start_server(self.handle, host or '127.0.0.1', port)
+        else:
+            await self.claim(socket_path)
+            # created with mode 0600 right away, a chmod afterwards would leave a moment for others to connect
+            umask = os.umask(0o177)
+            try:
+                server = await asyncio.start_unix_server(self.handle, socket_path)
+            finally:
+                os.umask(umask)
+        async with server:
+            await self.stopped.wait()
+        await self.cli.device.disconnect()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Keep strips connected and accept commands over a local socket.')
+    parser.add_argument('--socket', default=default_socket(), help='Unix socket path')
+    parser.add_argument('--host', default=None, help='serve on TCP instead, defaults to 127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='serve on this localhost TCP port')
+    parser.add_argument('--no-autoconnect', action='store_true', help='do not connect to strips on startup')
+    parser.add_argument('--clock-interval', type=float, default=None,
+                        help='keep the clocks and schedules of the strips set, syncing every this many minutes')
+    parser.add_argument('--metrics-port', type=int, default=None, help='serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--metrics-dump', default=None, help='write the metrics as JSON to this file periodically')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='seconds between JSON dumps')
+    args = parser.parse_args()
+
+    daemon = Daemon(CLI())
+    exporters = []
+    if args.metrics_port is not None:
+        exporters.append(asyncio.create_task(metrics.serve(args.metrics_host, args.metrics_port)))
+    if args.metrics_dump is not None:
+        exporters.append(asyncio.create_task(metrics.dump(args.metrics_dump, args.metrics_interval)))
+    if not args.no_autoconnect:
+        print((await daemon.execute('autoconnect'))['output'], end='')
+    if args.clock_interval is not None:
+        print((await daemon.execute(f'clock on {args.clock_interval}'))['output'], end='')
+    try:
+        await daemon.serve(args.socket, args.host, args.port)
+    finally:
+        for task in exporters:
+            task.cancel()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,4 +1,13 @@
+import asyncio
+import json
+import random
+import time
+
 from bleak import BleakClient, BleakScanner, BLEDevice
+from bleak.exc import BleakError
+
+import codec
+from metrics import metrics
 
 CHARACTERISTIC_UUID = '0000fff3-0000-1000-8000-00805f9b34fb'
 
@@ -80,117 +89,526 @@ class DynamicModes:
         return [attr for attr in dir(cls) if not callable(getattr(cls, attr)) and not attr.startswith("__")]
 
 
-class ELKDevice:
-    device_address = []
-    clients: list[BleakClient] = []
+class PipelinedClient:
+    # Resolves the characteristic once per connection and lets up to max_in_flight writes, the size of the adapter's
+    # write buffer, be on the way at once. bleak already writes without response by default, so a single producer
+    # is not faster through it. What it adds is that concurrent producers never overflow the buffer.
+    def __init__(self, client: BleakClient, max_in_flight: int = 8):
+        self.client = client
+        self.characteristic = None
+        self.response = True
+        self.in_flight = asyncio.Semaphore(max_in_flight)  # keeps the adapter buffer from overflowing
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def resolve(self):
+        characteristic = self.client.services.get_characteristic(CHARACTERISTIC_UUID)
+        if characteristic is None:
+            raise ValueError(f"{self.client.address} has no characteristic {CHARACTERISTIC_UUID}")
+        self.characteristic = characteristic
+        self.response = 'write-without-response' not in characteristic.properties
+
+    async def connect(self, **kwargs):
+        self.characteristic = None
+        result = await self.client.connect(**kwargs)
+        self.resolve()
+        return result
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = None):
+        if char_specifier != CHARACTERISTIC_UUID:
+            return await self.client.write_gatt_char(char_specifier, data, response)
+        if self.characteristic is None:
+            self.resolve()
+        async with self.in_flight:
+            await self.client.write_gatt_char(self.characteristic, data, self.response if response is None else response)
+
+
+class ShadowClient:
+    stream_tolerance = 12.0  # redmean distance below which streamed colors are considered unchanged
+
+    def __init__(self, client: BleakClient):
+        self.client = client
+        self.state = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def invalidate(self):
+        self.state.clear()
+
+    @staticmethod
+    def color_distance(a: tuple, b: tuple) -> float:
+        # "redmean" approximation of perceived distance between two sRGB colors
+        mean_red = (a[0] + b[0]) / 2
+        dr, dg, db = a[0] - b[0], a[1] - b[1], a[2] - b[2]
+        return ((2 + mean_red / 256) * dr * dr + 4 * dg * dg + (2 + (255 - mean_red) / 256) * db * db) ** 0.5
 
-    async def connect(self):
-        for address in self.device_address:
-            client = BleakClient(address)
-            await client.connect()
-            self.clients.append(client)
+    @staticmethod
+    def key(command: str) -> str | None:
+        if command in ('color', 'effect', 'dynamic'):
+            return 'mode'
+        if command == 'time':
+            return None  # the clock moves on, always send it
+        return command
+
+    def unchanged(self, key: str, value: tuple, tolerance: float) -> bool:
+        if key not in self.state:
+            return False
+        previous = self.state[key]
+        if tolerance and previous[0] == value[0] == 'color':
+            return self.color_distance(previous[1], value[1]) <= tolerance
+        return previous == value
+
+    async def connect(self, **kwargs):
+        self.invalidate()
+        return await self.client.connect(**kwargs)
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = None, stream: bool = False,
+                              tolerance: float = 0.0):
+        # Only streamed frames are skipped when the strip already shows them. The remote or a schedule timer
+        # can change the strip behind our back, so an explicit command always goes out.
+        try:
+            command, args = codec.decode(data)
+        except ValueError:
+            command, args = None, None
+        key = self.key(command) if command is not None else None
+
+        if key is not None and stream and self.unchanged(key, (command, args), tolerance):
+            self.suppressed += 1
+            return False  # lets streams tell a skipped write from a fast one
+        self.state.pop(key, None)  # unknown until the write went through
+        await self.client.write_gatt_char(char_specifier, data, response)
+        self.sent += 1
+        if key is not None:
+            self.state[key] = (command, args)
+
+
+class DeviceUnavailable(Exception):
+    pass
+
+
+class Priority:
+    control = 0  # interactive commands, never wait behind stream frames
+    stream = 1
+
+
+def find_layer(client, layer: type):
+    # clients are wrapped in layers that keep the wrapped client in .client
+    while client is not None and not isinstance(client, layer):
+        client = getattr(client, 'client', None)
+    return client
+
+
+class ManagedClient:
+    reconnect_delay = 1.0
+    max_reconnect_delay = 60.0
+    queue_timeout = 5.0
+
+    def __init__(self, address: str, factory, queue_writes: bool = False, lanes: bool = True,
+                 max_stream_in_flight: int = 1, recorder=None, connected_callback=None):
+        self.address = address
+        self.connected_callback = connected_callback  # called with this client after every connect and reconnect
+        self.client = factory(address, disconnected_callback=self.on_disconnect)
+        self.queue_writes = queue_writes  # wait for a reconnect instead of failing fast
+        self.lanes = lanes  # let control writes overtake stream writes
+        self.stream_slots = asyncio.Semaphore(max_stream_in_flight)
+        self.control_idle = asyncio.Event()
+        self.control_idle.set()
+        self.control_pending = 0
+        self.streams = set()  # DeviceStreams feeding this device, flushed on power off
+        self.recorder = recorder  # recorder.Recorder that logs every write, None when not recording
+        self.write_latency = [metrics.histogram('write_latency_seconds', device=address, priority=name)
+                              for name in ('control', 'stream')]
+        self.write_errors = metrics.counter('write_errors_total', device=address)
+        self.state = 'disconnected'
+        self.ready = asyncio.Event()
+        self.reconnects = 0
+        self.failures = 0
+        self.last_error = None
+        self.task = None
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def stream_rate(self) -> float | None:
+        # frames per second the adaptive streams feeding this device are allowed, the slowest if there are several
+        rates = [stream.controller.rate for stream in self.streams if stream.controller is not None]
+        return min(rates) if rates else None
+
+    def health(self) -> dict:
+        return {'state': self.state, 'reconnects': self.reconnects, 'failures': self.failures,
+                'last_error': None if self.last_error is None else repr(self.last_error),
+                'stream_rate': self.stream_rate()}
+
+    def on_disconnect(self, _client=None):
+        if self.state == 'connected':
+            self.lost(None)
+
+    def lost(self, error: Exception | None):
+        self.last_error = error
+        if self.state in ('reconnecting', 'disconnected'):
+            return
+        self.state = 'reconnecting'
+        self.ready.clear()
+        self.task = asyncio.create_task(self.reconnect())
+
+    async def reconnect(self):
+        delay = self.reconnect_delay
+        while True:
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            try:
+                await self.client.connect()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            self.state = 'connected'
+            self.reconnects += 1
+            self.ready.set()
+            self.task = None
+            if self.connected_callback is not None:
+                self.connected_callback(self)
+            return
+
+    async def connect(self, **kwargs):
+        try:
+            result = await self.client.connect(**kwargs)
+        except Exception as e:
+            self.state = 'failed'
+            self.lost(e)
+            raise
+        self.state = 'connected'
+        self.ready.set()
+        if self.connected_callback is not None:
+            self.connected_callback(self)
+        return result
 
     async def disconnect(self):
+        self.state = 'disconnected'
+        self.ready.clear()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        return await self.client.disconnect()
+
+    async def send(self, char_specifier, data, *args, **kwargs):
+        if self.state != 'connected':
+            if not self.queue_writes or self.state != 'reconnecting':
+                raise DeviceUnavailable(f"{self.address} is {self.state}")
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise DeviceUnavailable(f"{self.address} is still {self.state}") from None
+        try:
+            return await self.client.write_gatt_char(char_specifier, data, *args, **kwargs)
+        except (BleakError, OSError) as e:
+            self.lost(e)
+            raise
+
+    async def write_gatt_char(self, char_specifier, data, *args, priority: int = Priority.control, **kwargs):
+        if self.recorder is None and not metrics.enabled:
+            return await self.schedule(char_specifier, data, *args, priority=priority, **kwargs)
+        # the latency covers the wait for a lane as well as the write itself
+        enqueued = time.monotonic()
+        try:
+            result = await self.schedule(char_specifier, data, *args, priority=priority, **kwargs)
+        except BaseException as e:
+            self.completed(data, priority, enqueued, e)
+            raise
+        self.completed(data, priority, enqueued, result)
+        return result
+
+    def completed(self, data, priority: int, enqueued: float, result):
+        if metrics.enabled:
+            if isinstance(result, BaseException):
+                self.write_errors.inc()
+            elif result is not False:  # writes the shadow skipped took no time on the link
+                self.write_latency[priority].observe(time.monotonic() - enqueued)
+        if self.recorder is not None:
+            self.recorder.record(self.address, data, priority, enqueued, result)
+
+    async def schedule(self, char_specifier, data, *args, priority: int = Priority.control, **kwargs):
+        if not self.lanes:
+            return await self.send(char_specifier, data, *args, **kwargs)
+
+        if priority == Priority.stream:
+            # few stream frames in flight at a time, and none issued while control writes wait
+            async with self.stream_slots:
+                await self.control_idle.wait()
+                return await self.send(char_specifier, data, *args, **kwargs)
+
+        self.control_pending += 1
+        self.control_idle.clear()
+        if bytes(data) == codec.power(False):
+            for stream in self.streams:
+                stream.flush()
+        try:
+            return await self.send(char_specifier, data, *args, **kwargs)
+        finally:
+            self.control_pending -= 1
+            if self.control_pending == 0:
+                self.control_idle.set()
+
+
+class ScanCache:
+    def __init__(self, path: str, ttl: float = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.devices = {}
+        try:
+            with open(path) as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def fresh(self) -> list[str]:
+        now = time.time()
+        return [address for address, entry in self.devices.items() if now - entry['seen'] < self.ttl]
+
+    def update(self, address: str, name: str = None):
+        self.devices[address] = {'name': name, 'seen': time.time()}
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.devices, f, indent=4)
+
+
+class ELKDevice:
+    client_factory = BleakClient
+    scanner_factory = BleakScanner
+    pipelined = False  # wrap new connections in PipelinedClient
+    shadowed = True  # wrap new connections in ShadowClient to skip streamed frames that change nothing
+    queue_writes = False  # writes to a reconnecting device wait for it instead of failing fast
+    priority_lanes = True  # control commands overtake streamed frames
+    max_in_flight = 8  # writes in flight per pipelined device, the write buffer of a typical adapter
+    recorder = None  # recorder.Recorder given to every ManagedClient, see record()
+    synchronizer = None  # presentation.Synchronizer, when set broadcast times the sends to land together
+    clock = None  # clock.ClockSync, when set strips get the time and their schedules whenever they connect
+    max_concurrency = 8  # upper bound on simultaneous connects / writes
+    timeout = 10.0  # seconds a single device may take before it is reported as failed
+
+    def __init__(self):
+        self.device_address = []
+        self.clients: list[BleakClient] = []  # ManagedClient per address, in the order the addresses were added
+        self.pool: dict[str, BleakClient] = {}
+
+    async def fan_out(self, func, targets: list, *args, concurrency: int = None) -> list[tuple[object, Exception | None]]:
+        semaphore = asyncio.Semaphore(concurrency or self.max_concurrency)
+
+        async def run(target):
+            async with semaphore:
+                try:
+                    await asyncio.wait_for(func(target, *args), self.timeout)
+                except Exception as e:
+                    return target, e
+                return target, None
+
+        return list(await asyncio.gather(*(run(target) for target in targets)))
+
+    async def broadcast(self, func, *args, clients: list[BleakClient] = None) -> list[tuple[BleakClient, Exception | None]]:
+        clients = list(self.clients if clients is None else clients)
+        if self.synchronizer is not None:
+            return await self.synchronizer.present(func, clients, *args)
+        return await self.fan_out(func, clients, *args)
+
+    def new_client(self, address: str, **kwargs) -> BleakClient:
+        client = self.client_factory(address, **kwargs)
+        if self.pipelined:
+            client = PipelinedClient(client, self.max_in_flight)
+        if self.shadowed:
+            client = ShadowClient(client)
+        return client
+
+    def resync(self):
+        for client in self.clients:
+            shadow = find_layer(client, ShadowClient)
+            if shadow is not None:
+                shadow.invalidate()
+
+    def shadow_stats(self) -> dict[str, dict[str, int]]:
+        shadows = [find_layer(client, ShadowClient) for client in self.clients]
+        return {shadow.address: {'sent': shadow.sent, 'suppressed': shadow.suppressed}
+                for shadow in shadows if shadow is not None}
+
+    def health(self) -> dict[str, dict]:
+        return {client.address: client.health() for client in self.clients}
+
+    def collect(self) -> list[tuple]:
+        # metrics read from the clients when they are asked for, see metrics.Metrics.collectors
+        samples = []
+        for client in self.clients:
+            labels = {'device': client.address}
+            pending = client.control_pending + sum(stream.pending is not None for stream in client.streams)
+            shadow = find_layer(client, ShadowClient)
+            samples += [
+                ('connected', labels, 'gauge', int(client.state == 'connected')),
+                ('queue_depth', labels, 'gauge', pending),
+                ('reconnects_total', labels, 'counter', client.reconnects),
+                ('reconnect_failures_total', labels, 'counter', client.failures),
+            ]
+            if shadow is not None:
+                samples.append(('writes_suppressed_total', labels, 'counter', shadow.suppressed))
+            rate = client.stream_rate()
+            if rate is not None:
+                samples.append(('stream_rate', labels, 'gauge', rate))
+        return samples
+
+    def record(self, recorder):
+        # start logging the writes of every device, or stop with None
+        self.recorder = recorder
         for client in self.clients:
-            await client.disconnect()
-            self.clients.remove(client)
+            client.recorder = recorder
+
+    def connected(self, client: ManagedClient):
+        if self.clock is not None:
+            self.clock.connected(client)
+
+    def client(self, address: str) -> ManagedClient:
+        return self.pool[address]
+
+    def ensure_client(self, address: str) -> ManagedClient:
+        # every address gets a pool entry right away, even if it cannot be reached yet, so that
+        # the position of a device in clients never depends on which strips happened to connect
+        if address not in self.pool:
+            self.pool[address] = ManagedClient(address, self.new_client, self.queue_writes, self.priority_lanes,
+                                               recorder=self.recorder, connected_callback=self.connected)
+            self.clients.append(self.pool[address])
+        return self.pool[address]
+
+    async def connect(self) -> list[tuple[str, Exception | None]]:
+        pending = [address for address in self.device_address
+                   if self.ensure_client(address).state in ('disconnected', 'failed')]
+
+        async def connect_address(address: str):
+            await self.pool[address].connect()
+
+        return await self.fan_out(connect_address, pending)
+
+    async def connect_address(self, address: str) -> tuple[str, Exception | None]:
+        if address not in self.device_address:
+            self.add_address(address)
+        if self.ensure_client(address).state not in ('disconnected', 'failed'):
+            return address, None
+        return (await self.fan_out(lambda target: self.pool[target].connect(), [address]))[0]
+
+    async def disconnect(self) -> list[tuple[BleakClient, Exception | None]]:
+        results = await self.fan_out(lambda client: client.disconnect(), list(self.clients))
+        self.clients.clear()
+        self.pool.clear()
+        return results
 
     def add_address(self, address: str):
         self.device_address.append(address)
 
     @staticmethod
-    async def search() -> list[BLEDevice]:
-        scanner = BleakScanner()
+    def is_target(device: BLEDevice, advertisement=None) -> bool:
+        # the name is optional in advertisements, bleak reports None when it is missing
+        name = device.name or getattr(advertisement, 'local_name', None)
+        return name is not None and 'ELK-BLEDOM' in name
+
+    @classmethod
+    async def search(cls) -> list[BLEDevice]:
+        scanner = cls.scanner_factory()
         devices = await scanner.discover()
 
-        target_devices = [dev for dev in devices if 'ELK-BLEDOM' in dev.name]
+        target_devices = [dev for dev in devices if cls.is_target(dev)]
         return target_devices
 
+    async def discover(self, known: set[str] = None, timeout: float = 10.0):
+        found = asyncio.Queue()
+        seen = set()
+        wanted = {address.upper() for address in known or ()}
+        missing = set(wanted)
+
+        def detection_callback(device: BLEDevice, advertisement):
+            # a strip we are looking for counts by its address, it may advertise without a name
+            if device.address not in seen and (device.address.upper() in wanted
+                                               or self.is_target(device, advertisement)):
+                seen.add(device.address)
+                found.put_nowait(device)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        scanner = self.scanner_factory(detection_callback=detection_callback)
+        await scanner.start()
+        try:
+            while loop.time() < deadline:
+                try:
+                    device = await asyncio.wait_for(found.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return
+                yield device
+                # stop as soon as every strip we were looking for has shown up
+                missing.discard(device.address.upper())
+                if known and not missing:
+                    return
+        finally:
+            await scanner.stop()
+
+    @staticmethod
+    async def write(client: BleakClient, frame):
+        return await client.write_gatt_char(CHARACTERISTIC_UUID, frame)
+
     @staticmethod
     async def power_on(client: BleakClient):
-        await client.write_gatt_char(CHARACTERISTIC_UUID, b'\x7e\x00\x04\xf0\x00\x01\xff\x00\xef')
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.power(True))
 
     @staticmethod
     async def power_off(client: BleakClient):
-        await client.write_gatt_char(CHARACTERISTIC_UUID, b'\x7e\x00\x04\x00\x00\x00\xff\x00\xee')
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.power(False))
 
     @staticmethod
     async def set_brightness(client: BleakClient, brightness: int):
-        command = b'\x7e\x00\x01'
-        command += bytes([min(brightness, 0x64)])
-        command += b'\x00\x00\x00\x00\xef'
-
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.brightness(brightness))
 
     @staticmethod
     async def set_color(client: BleakClient, r: int, g: int, b: int):
-        command = b'\x7e\x00\x05\x03'
-        command += bytes([r, g, b])
-        command += b'\x00\xef'
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.color(r, g, b))
 
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+    @staticmethod
+    async def stream(client: BleakClient, frame):
+        kwargs = {}
+        if isinstance(client, ManagedClient):
+            kwargs['priority'] = Priority.stream
+        if find_layer(client, ShadowClient) is not None:
+            kwargs['stream'] = True
+            kwargs['tolerance'] = ShadowClient.stream_tolerance
+        return await client.write_gatt_char(CHARACTERISTIC_UUID, frame, **kwargs)
 
     @staticmethod
-    async def set_effect(client: BleakClient, effect: bytes):
-        command = b'\x7e\x00\x03'
-        command += effect
-        command += b'\x03\x00\x00\x00\xef'
+    async def stream_color(client: BleakClient, r: int, g: int, b: int):
+        return await ELKDevice.stream(client, codec.color(r, g, b))
 
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+    @staticmethod
+    async def set_effect(client: BleakClient, effect: bytes):
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.effect(effect))
 
     @staticmethod
     async def set_effect_speed(client: BleakClient, speed: int):
-        command = b'\x7e\x00\x02'
-        command += bytes([speed])
-        command += b'\x00\x00\x00\x00\xef'
-
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.speed(speed))
 
     @staticmethod
     async def set_time(client: BleakClient, hour: int, minute: int, second: int, day_of_week: int):
-        command = b'\x7e\x00\x83'
-        command += bytes([hour, minute, second, day_of_week])
-        command += b'\x00\xef'
-
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.time(hour, minute, second, day_of_week))
 
     @staticmethod
     async def set_schedule_on(client: BleakClient, days: str, hour: int, minute: int, enable: bool):
-        if enable:
-            value = bytes([int(Days.from_string(days)) + 0x80])
-        else:
-            value = Days.from_string(days)
-
-        command = b'\x7e\x00\x82'
-        command += bytes([hour, minute])
-        command += b'\x00\x00'
-        command += value
-        command += b'\xef'
-
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        await client.write_gatt_char(CHARACTERISTIC_UUID,
+                                     codec.schedule(True, Days.from_string(days), hour, minute, enable))
 
     @staticmethod
     async def set_schedule_off(client: BleakClient, days: str, hour: int, minute: int, enable: bool):
-        if enable:
-            value = bytes([int(Days.from_string(days)) + 0x80])
-        else:
-            value = Days.from_string(days)
-
-        command = b'\x7e\x00\x82'
-        command += bytes([hour, minute])
-        command += b'\x00\x01'
-        command += value
-        command += b'\xef'
-
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        await client.write_gatt_char(CHARACTERISTIC_UUID,
+                                     codec.schedule(False, Days.from_string(days), hour, minute, enable))
 
     @staticmethod
     async def set_dynamic(client: BleakClient, mode: bytes):
-        command = b'\x7e\x00\x03'
-        command += mode
-        command += b'\x04\x00\x00\x00\xef'
-
-        await client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.dynamic(mode))
 
 
 if __name__ == "__main__":
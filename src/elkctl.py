@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+
+def default_socket() -> str:
+    # keep in sync with daemon.default_socket, importing it would pull in the whole BLE stack
+    runtime = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime, f'elkble-{os.getuid()}.sock')
+
+
+def send(commands: list[str], socket_path: str = None, host: str = None, port: int = None) -> dict:
+    if port is not None:
+        connection = socket.create_connection((host or '127.0.0.1', port))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path or default_socket())
+    with connection, connection.makefile('rwb') as stream:
+        stream.write(json.dumps({'commands': commands}).encode() + b'\n')
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Send commands to a running elkble daemon.')
+    parser.add_argument('command', nargs='*', help="one command, or several separated by ';'. Use - to read stdin")
+    parser.add_argument('--socket', default=None)
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == ['-']:
+        commands = [line.strip() for line in sys.stdin if line.strip()]
+    else:
+        commands = [command.strip() for command in ' '.join(args.command).split(';') if command.strip()]
+
+    try:
+        response = send(commands, args.socket, args.host, args.port)
+    except OSError as e:
+        print(f"Cannot reach the elkble daemon: {e}", file=sys.stderr)
+        return 2
+    if 'error' in response:
+        print(response['error'], file=sys.stderr)
+        return 1
+
+    failed = False
+    for result in response['results']:
+        print(result['output'], end='')
+        if result['error'] is not None:
+            print(f"{result['command']}: {result['error']}", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import asyncio
+import random
+import time
+
+from bleak import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+from bleak.exc import BleakError
+
+import codec
+from elkble import CHARACTERISTIC_UUID, ELKDevice
+
+
+class EmulatedCharacteristic:
+    uuid = CHARACTERISTIC_UUID
+    properties = ['write-without-response', 'write']
+
+
+class EmulatedServices:
+    characteristic = EmulatedCharacteristic()
+
+    def get_characteristic(self, uuid):
+        return self.characteristic if str(uuid).lower() == CHARACTERISTIC_UUID else None
+
+
+class EmulatedStrip:
+    def __init__(self, address: str, name: str = 'ELK-BLEDOM'):
+        self.address = address
+        self.name = name
+        self.power = False
+        self.color = (0, 0, 0)
+        self.brightness = 0x64
+        self.speed = 0
+        self.effect = None
+        self.dynamic = None
+        self.time = None
+        self.schedule_on = None
+        self.schedule_off = None
+        self.frames = 0
+        self.updated = 0.0  # monotonic time of the last applied frame
+        self.capacity = None  # writes per second the link can take, None for unlimited
+        self.latency = None  # write latency of this strip, None for the fleet's
+        self.busy_until = 0.0
+
+    def apply(self, frame):
+        command, args = codec.decode(frame)
+        if command == 'power':
+            self.power = args[0]
+        elif command == 'color':
+            self.color = args
+            self.effect = self.dynamic = None
+        elif command == 'effect':
+            self.effect = args[0]
+            self.dynamic = None
+        elif command == 'dynamic':
+            self.dynamic = args[0]
+            self.effect = None
+        else:
+            setattr(self, command, args[0] if len(args) == 1 else args)
+        self.frames += 1
+        self.updated = time.monotonic()
+
+
+class Fleet:
+    def __init__(self, size: int = 0, latency: float = 0.01, jitter: float = 0.0, loss: float = 0.0,
+                 disconnect_rate: float = 0.0, connect_latency: float = 0.1, advertise_interval: float = 0.1,
+                 capacity: float = None, latency_spread: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.latency_spread = latency_spread  # strips get a fixed extra latency up to this, like links of varying quality
+        self.jitter = jitter
+        self.loss = loss  # probability that a write is silently lost
+        self.disconnect_rate = disconnect_rate  # probability that a write drops the link
+        self.connect_latency = connect_latency
+        self.advertise_interval = advertise_interval
+        self.capacity = capacity
+        self.random = random.Random(seed)
+        self.strips: dict[str, EmulatedStrip] = {}
+        self.lost = 0
+        self.disconnects = 0
+        for i in range(size):
+            self.add(f'BE:59:00:00:{i >> 8:02X}:{i & 0xff:02X}')
+
+    def add(self, address: str, name: str = 'ELK-BLEDOM') -> EmulatedStrip:
+        strip = EmulatedStrip(address, name)
+        strip.capacity = self.capacity
+        if self.latency_spread:
+            strip.latency = self.latency + self.random.uniform(0, self.latency_spread)
+        self.strips[address] = strip
+        return strip
+
+    def delay(self, base: float) -> float:
+        return max(base + self.random.uniform(-self.jitter, self.jitter), 0)
+
+    def client(self, address, **kwargs) -> 'EmulatedClient':
+        return EmulatedClient(address, self, **kwargs)
+
+    def scanner(self, detection_callback=None, **kwargs) -> 'EmulatedScanner':
+        return EmulatedScanner(detection_callback, fleet=self)
+
+    def device(self, concurrency: int = ELKDevice.max_concurrency) -> ELKDevice:
+        # an ELKDevice that knows every strip of the fleet and connects and scans through it
+        device = ELKDevice()
+        device.device_address = list(self.strips)
+        device.client_factory = self.client
+        device.scanner_factory = self.scanner
+        device.max_concurrency = concurrency
+        return device
+
+
+class EmulatedClient:
+    def __init__(self, address_or_ble_device, fleet: Fleet, disconnected_callback=None, **kwargs):
+        self.address = getattr(address_or_ble_device, 'address', address_or_ble_device)
+        self.fleet = fleet
+        self.disconnected_callback = disconnected_callback
+        self.services = EmulatedServices()
+        self.is_connected = False
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.fleet.delay(self.fleet.connect_latency))
+        if self.address not in self.fleet.strips:
+            raise BleakError(f"Device with address {self.address} was not found.")
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+        return True
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = False):
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        strip = self.fleet.strips[self.address]
+        latency = self.fleet.latency if strip.latency is None else strip.latency
+        delay = self.fleet.delay(latency * (2 if response else 1))
+        if strip.capacity:
+            # writes queue up behind each other once they arrive faster than the link drains them
+            now = time.monotonic()
+            strip.busy_until = max(now, strip.busy_until) + 1 / strip.capacity
+            delay += strip.busy_until - now
+        await asyncio.sleep(delay)
+        if self.fleet.random.random() < self.fleet.disconnect_rate:
+            self.is_connected = False
+            self.fleet.disconnects += 1
+            if self.disconnected_callback is not None:
+                self.disconnected_callback(self)
+            raise BleakError("Not connected")
+        if self.fleet.random.random() < self.fleet.loss:
+            self.fleet.lost += 1
+            if response:
+                raise BleakError("ATT error: write not acknowledged")
+            return
+        self.fleet.strips[self.address].apply(data)
+
+
+class EmulatedScanner:
+    def __init__(self, detection_callback=None, fleet: Fleet = None, **kwargs):
+        self.detection_callback = detection_callback
+        self.fleet = fleet
+        self.task = None
+
+    def advertisement(self, strip: EmulatedStrip) -> tuple[BLEDevice, AdvertisementData]:
+        device = BLEDevice(strip.address, strip.name, None, -60)
+        data = AdvertisementData(strip.name, {}, {}, [], None, -60, ())
+        return device, data
+
+    async def advertise(self):
+        strips = list(self.fleet.strips.values())
+        self.fleet.random.shuffle(strips)
+        for strip in strips:
+            await asyncio.sleep(self.fleet.delay(self.fleet.advertise_interval / max(len(strips), 1)))
+            if self.detection_callback is not None:
+                self.detection_callback(*self.advertisement(strip))
+
+    async def start(self):
+        self.task = asyncio.create_task(self.advertise())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def discover(self, timeout: float = 5.0, **kwargs) -> list[BLEDevice]:
+        await asyncio.sleep(timeout)
+        return [self.advertisement(strip)[0] for strip in self.fleet.strips.values()]
@@ -1,13 +1,25 @@
+import argparse
 import asyncio
+import colorsys
 import json
+import os
+import sys
+import time
 from datetime import datetime
+from typing import TextIO
 
-from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import NestedCompleter
-from prompt_toolkit.history import InMemoryHistory
+# prompt_toolkit, NumPy and the audio stack are imported where they are used,
+# so that one-shot commands like 'power off' start without loading them
+from elkble import ELKDevice, Effects, DynamicModes, ScanCache
+from metrics import metrics
+from clock import ClockSync
+from registry import Registry
+from stream import StreamWriter
 
-from audio import Audio
-from elkble import ELKDevice, Effects, DynamicModes
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CLIENTS_PATH = os.path.join(CONFIG_DIR, 'clients.json')
+SCAN_CACHE_PATH = os.path.join(CONFIG_DIR, 'scan_cache.json')
+SCENES_PATH = os.path.join(CONFIG_DIR, 'scenes.json')
 
 week_days = {
     'monday': None,
@@ -23,18 +35,38 @@ week_days = {
     'none': None,
 }
 
+HUE_STEP = 0.1  # hue advance per detected beat in 'live beat' mode
+
 
 class CLI:
     device = ELKDevice()
-    audio = Audio()
     live_task = None
+    live_stream = None
+    animation_task = None
+    animation = None
+    play_task = None
+    player = None
+    scenes = None
+    pipeline = None
+    pipeline_inputs = None  # PyAudio input device indexes when live mode analyzes in worker processes
     tasks = []
-    clients = []
-    history = InMemoryHistory()
+    history = None
     nested_dict = {
         'add': None,
+        'animate': {
+            'chase': None,
+            'fade': None,
+            'gradient': None,
+            'rainbow': None,
+            'stop': None,
+        },
         'autoconnect': None,
         'brightness': None,
+        'clock': {
+            'off': None,
+            'on': None,
+            'sync': None,
+        },
         'color': None,
         'connect': None,
         'disconnect': None,
@@ -77,9 +109,17 @@ class CLI:
         },
         'exit': None,
         'live': {
+            'beat': None,
             'start': None,
             'stop': None,
         },
+        'pipeline': {
+            'off': None,
+            'on': None,
+        },
+        'play': {
+            'stop': None,
+        },
         'power': {
             'on': None,
             'off': None,
@@ -94,274 +134,653 @@ class CLI:
                 'disable': week_days,
             },
         },
+        'record': {
+            'start': None,
+            'stop': None,
+        },
+        'resync': None,
+        'scene': None,
+        'script': None,
         'search': None,
         'speed': None,
+        'stats': {
+            'json': None,
+            'off': None,
+            'on': None,
+            'prometheus': None,
+            'reset': None,
+        },
+        'status': None,
+        'sync': {
+            'off': None,
+            'on': None,
+        },
         'time': None,
+        'transport': {
+            'default': None,
+            'pipelined': None,
+        },
+    }
+
+    device_commands = {
+        'brightness': "<brightness> [device|group]",
+        'color': "<r> <g> <b> [device|group]",
+        'dynamic': "<dynamic_name> [device|group]",
+        'effect': "<effect_name> [device|group]",
+        'power': "<on|off> [device|group]",
+        'schedule': "<on|off> <enable|disable> <days> <h> <m> [device|group]",
+        'speed': "<speed> [device|group]",
+        'time': "<h m s d|now> [device|group]",
     }
 
     def __init__(self):
-        config = json.load(open('../clients.json'))
-        for client in config['clients']:
-            self.clients.append(client)
-        if len(self.clients) != 0:
-            name_dic = {client['name']: None for client in self.clients}
-            for key in self.nested_dict['dynamic']:
-                self.nested_dict['dynamic'][key] = name_dic
-            for key in self.nested_dict['effect']:
-                self.nested_dict['effect'][key] = name_dic
+        self.scan_cache = ScanCache(SCAN_CACHE_PATH)
+        self.registry = Registry(CLIENTS_PATH)
+        self.session = None
+        metrics.collectors.append(self.device.collect)
+        metrics.collectors.append(self.collect_pipeline)
+        self.clock = ClockSync(self.device, self.registry, refresh=self.refresh)
+        self.update_completions()
+
+    def update_completions(self):
+        targets = {name: None for name in self.registry.names()}
+        for key in ('on', 'off'):
+            self.nested_dict['power'][key] = targets
+        for key in ('start', 'beat'):
+            self.nested_dict['live'][key] = targets
+        for key in self.nested_dict['dynamic']:
+            self.nested_dict['dynamic'][key] = targets
+        for key in self.nested_dict['effect']:
+            self.nested_dict['effect'][key] = targets
+        if self.session is not None:
+            from prompt_toolkit.completion import NestedCompleter
 
+            self.completer = NestedCompleter.from_nested_dict(self.nested_dict)
+            self.session.completer = self.completer
+
+    def refresh(self, out: TextIO = None):
+        # clients.json is re-read whenever it changed on disk, so names and groups can be edited while running
+        try:
+            if self.registry.refresh():
+                self.update_completions()
+        except (ValueError, KeyError) as e:
+            print(f"Keeping the previous clients.json, the new one is invalid: {e!r}", file=out)
+
+    def select(self, target: str = None, out: TextIO = None) -> list:
+        # no target means every strip, anything else is an id, name, MAC, group or tag from clients.json
+        if target is None:
+            return self.device.clients
+        addresses = self.registry.resolve(target)
+        if addresses is None:
+            raise ValueError(f"unknown device or group {target}")
+        for address in addresses:
+            if address not in self.device.pool:
+                print(f"{address}: not connected", file=out)
+        return [self.device.pool[address] for address in addresses if address in self.device.pool]
+
+    def addresses(self, target: str = None) -> list[str]:
+        # like select, but devices that are not connected stay in so that they are reported
+        if target is None or target == 'all':
+            return [client.address for client in self.device.clients]
+        addresses = self.registry.resolve(target)
+        if addresses is None:
+            raise ValueError(f"unknown device or group {target}")
+        return addresses
+
+    def compile_script(self, path: str) -> list:
+        # consecutive device commands become one batch of (target, frame) pairs, anything else runs as it is
+        from scenes import ENCODERS, encode
+
+        steps = []
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                cmd_parts = line.split('#', 1)[0].split()
+                if not cmd_parts:
+                    continue
+                if cmd_parts[0] not in self.device_commands:
+                    steps.append(' '.join(cmd_parts))
+                    continue
+                try:
+                    func, args, target = self.parse_device_command(cmd_parts)
+                except (ValueError, IndexError, AttributeError) as e:
+                    raise ValueError(f"{path}:{number}: {e}") from None
+                if func not in ENCODERS:
+                    steps.append(' '.join(cmd_parts))  # e.g. time now, which is stamped per strip when it is sent
+                    continue
+                frame = encode(func, args)
+                if not steps or isinstance(steps[-1], str):
+                    steps.append([])
+                steps[-1].append((target, frame))
+        return steps
+
+    async def run_script(self, path: str, out: TextIO = None):
+        from scenes import Plan
+
+        for step in self.compile_script(path):
+            if isinstance(step, str):
+                await self.process_command(step, out)
+                continue
+            # targets are resolved only now, the commands before may have connected devices
+            plan = Plan()
+            for target, frame in step:
+                plan.add(self.addresses(target), frame)
+            self.report(await plan.apply(self.device), out)
+
+    def connects(self, cmd_parts: list[str]) -> bool:
+        # whether a one-shot command talks to the strips, the others run without connecting to any
+        return bool(cmd_parts) and (cmd_parts[0] in self.device_commands or cmd_parts[0] in ('scene', 'script')
+                                    or cmd_parts[:2] == ['clock', 'sync'])
+
+    def parse_device_command(self, cmd_parts: list[str]) -> tuple:
+        command, args = cmd_parts[0], cmd_parts[1:]
+        if command == 'power':
+            if args[0] not in ('on', 'off'):
+                raise ValueError("expected on or off")
+            func, values, rest = self.device.power_on if args[0] == 'on' else self.device.power_off, [], args[1:]
+        elif command == 'color':
+            func, values, rest = self.device.set_color, [int(arg) for arg in args[:3]], args[3:]
+            if len(values) != 3:
+                raise ValueError("expected three color values")
+        elif command == 'effect':
+            try:
+                func, values, rest = self.device.set_effect, [Effects.from_string(args[0])], args[1:]
+            except AttributeError:
+                raise ValueError("possible effects: " + str(Effects.to_list()))
+        elif command == 'dynamic':
+            try:
+                func, values, rest = self.device.set_dynamic, [DynamicModes.from_string(args[0])], args[1:]
+            except AttributeError:
+                raise ValueError("possible dynamics: " + str(DynamicModes.to_list()))
+        elif command == 'speed':
+            func, values, rest = self.device.set_effect_speed, [int(args[0])], args[1:]
+        elif command == 'brightness':
+            func, values, rest = self.device.set_brightness, [int(args[0])], args[1:]
+        elif command == 'time':
+            if args[0] == 'now':
+                # every strip gets the time it will be when the write arrives, not when the command was typed
+                func, values, rest = self.clock.stamp, [], args[1:]
+            else:
+                func, values, rest = self.device.set_time, [int(arg) for arg in args[:4]], args[4:]
+                if len(values) != 4:
+                    raise ValueError("expected hour, minute, second and day")
+        else:
+            if args[0] not in ('on', 'off') or args[1] not in ('enable', 'enabled', 'disable', 'disabled'):
+                raise ValueError("expected on|off and enable|disable")
+            func = self.device.set_schedule_on if args[0] == 'on' else self.device.set_schedule_off
+            values, rest = [args[2], int(args[3]), int(args[4]), args[1].startswith('enable')], args[5:]
+        if len(rest) > 1:
+            raise ValueError("too many arguments")
+        return func, values, rest[0] if rest else None
+
+    async def process_input(self):
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.completion import NestedCompleter
+        from prompt_toolkit.history import InMemoryHistory
+
+        self.history = InMemoryHistory()
         self.completer = NestedCompleter.from_nested_dict(self.nested_dict)
         self.session = PromptSession(
             history=self.history,
             completer=self.completer,
         )
-
-    async def process_input(self):
         while True:
             cmd = await self.session.prompt_async('> ')
             await self.process_command(cmd)
 
-    async def audio_to_rgb(self, device_index=None):
+    def zone(self, address: str):
+        from audio import Zone
+
+        config = self.registry.zone(address)
+        return Zone() if config is None else Zone.from_dict(config)
+
+    async def audio_to_rgb(self, clients=None, on_beat=False):
+        import numpy as np
+
+        import codec
+        from audio import Audio, SR, ZoneMapper
+        from beat import BeatDetector
+        from capture import Capture, MicrophoneSource
+
+        self.live_stream = StreamWriter(self.device.stream, adaptive=True)
+        detector = BeatDetector()
+        hue = 0.0
+        mapper = frames = flash = None
+        mapped = None  # clients and clients.json version the mapper was built for
+        fft_histogram = metrics.histogram('fft_seconds')
+        encode_histogram = metrics.histogram('encode_seconds')
+        try:
+            async with Capture(MicrophoneSource()) as capture:
+                async for audio_data in capture.windows():
+                    targets = self.device.clients if clients is None else clients
+                    started = time.perf_counter()
+                    magnitude = Audio.analyzer.spectrum(audio_data)
+                    if metrics.enabled:
+                        fft_histogram.observe(time.perf_counter() - started)
+                    if on_beat:
+                        # only send on beats, advancing the hue each time
+                        beat = detector.update(magnitude, (capture.position + capture.window) / SR)
+                        if beat is None:
+                            continue
+                        hue = (hue + HUE_STEP) % 1.0
+                        r, g, b = (int(c * 255) for c in colorsys.hsv_to_rgb(hue, 1.0, 1.0))
+                        flash = self.flash(targets, codec.color(r, g, b), flash)
+                        continue
+
+                    # every strip gets its own zone, all computed from the one spectrum
+                    if mapped != (len(targets), self.registry.mtime):
+                        mapped = (len(targets), self.registry.mtime)
+                        mapper = ZoneMapper([self.zone(client.address) for client in targets], capture.window,
+                                            SR, capture.hop / SR)
+                        frames = np.empty((len(targets), codec.FRAME_SIZE), dtype=np.uint8)
+                    started = time.perf_counter()
+                    codec.colors(mapper.update(magnitude).astype(int), frames)
+                    if metrics.enabled:
+                        encode_histogram.observe(time.perf_counter() - started)
+                    for client, frame in zip(targets, frames):
+                        self.live_stream.push(client, frame.tobytes())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if flash is not None:
+                await asyncio.gather(flash, return_exceptions=True)
+            await self.live_stream.close()
+
+    def flash(self, targets: list, frame: bytes, flash: asyncio.Task = None) -> asyncio.Task | None:
+        # returns the flash that is in flight when the synchronizer sends it
+        if self.device.synchronizer is None:
+            self.live_stream.push_all(targets, frame)
+        elif flash is None or flash.done():
+            # the flash lands on every strip at once, a beat during the previous one is skipped
+            flash = asyncio.create_task(self.device.synchronizer.present(self.device.stream, targets, frame))
+        return flash
+
+    async def pipeline_to_rgb(self, clients=None, on_beat=False):
+        # live mode with capture and analysis in worker processes, the loop only pushes the colors they send back
+        import numpy as np
+
+        import codec
+        from capture import MicrophoneSource
+        from pipeline import Input, Pipeline
+
+        self.live_stream = StreamWriter(self.device.stream, adaptive=True)
+        hue = 0.0
+        flash = None
         try:
-            loop = asyncio.get_event_loop()
-            self.audio.open()
             while True:
-                audio_data = await loop.run_in_executor(None, self.audio.get_audio)
-                r, g, b = Audio.audio_to_rgb(audio_data)
-                if device_index is None:
-                    for client in self.device.clients:
-                        await self.device.set_color(client, r, g, b)
-                else:
-                    await self.device.set_color(self.device.clients[device_index], r, g, b)
-                await asyncio.sleep(0.1)
+                # the zones are built into the workers, so a change of the strips or clients.json restarts them
+                targets = list(self.device.clients if clients is None else clients)
+                built = (len(targets), self.registry.mtime)
+                assigned = [[] for _ in self.pipeline_inputs]
+                for client in targets:
+                    assigned[min(self.registry.input(client.address), len(assigned) - 1)].append(client)
+                inputs = [Input(MicrophoneSource(device=index), [self.zone(client.address) for client in strips])
+                          for index, strips in zip(self.pipeline_inputs, assigned)]
+                frames = [np.empty((len(strips), codec.FRAME_SIZE), dtype=np.uint8) for strips in assigned]
+                async with Pipeline(inputs) as self.pipeline:
+                    async for result in self.pipeline.analyzed():
+                        if built != (len(self.device.clients if clients is None else clients), self.registry.mtime):
+                            break
+                        strips = assigned[result.input]
+                        if on_beat:
+                            if result.beat:
+                                hue = (hue + HUE_STEP) % 1.0
+                                r, g, b = (int(c * 255) for c in colorsys.hsv_to_rgb(hue, 1.0, 1.0))
+                                flash = self.flash(strips, codec.color(r, g, b), flash)
+                            continue
+                        codec.colors(result.colors.astype(int), frames[result.input])
+                        for client, frame in zip(strips, frames[result.input]):
+                            self.live_stream.push(client, frame.tobytes())
+                    else:
+                        return  # the inputs ended
         except asyncio.CancelledError:
             pass
         finally:
-            self.audio.close()
+            if flash is not None:
+                await asyncio.gather(flash, return_exceptions=True)
+            await self.live_stream.close()
+
+    def collect_pipeline(self) -> list[tuple]:
+        return [] if self.pipeline is None else self.pipeline.collect()
+
+    @staticmethod
+    def report(results: list, out: TextIO = None):
+        for target, error in results:
+            if error is not None:
+                print(f"{getattr(target, 'address', target)}: {error!r}", file=out)
+
+    @staticmethod
+    def print_stats(out: TextIO = None):
+        snapshot = metrics.snapshot()
+        for name, series in sorted(snapshot['histograms'].items()):
+            for entry in series:
+                labels = ''.join(f" {value}" for value in entry['labels'].values())
+                print(f"{name}{labels}: {entry['count']} samples, mean {entry['sum'] / entry['count'] * 1000:.2f} ms, "
+                      f"p50 <= {entry['p50'] * 1000:g} ms, p95 <= {entry['p95'] * 1000:g} ms, "
+                      f"p99 <= {entry['p99'] * 1000:g} ms", file=out)
+        for name, series in sorted(snapshot['values'].items()):
+            values = ', '.join(f"{entry['labels'].get('device', '')} {entry['value']}".strip() for entry in series)
+            print(f"{name}: {values}", file=out)
+        if not metrics.enabled:
+            print("Collection is off, 'stats on' turns it back on.", file=out)
 
     async def run(self):
         self.tasks.append(asyncio.create_task(self.process_input()))
         await asyncio.gather(*self.tasks)
 
-    async def process_command(self, cmd: str):
+    async def process_command(self, cmd: str, out: TextIO = None):
+        # everything the command prints goes to out, the daemon gives every request a stream of its own
         cmd_parts = cmd.split()
+        self.refresh(out)
 
         if len(cmd_parts) == 0:
             print(
-                "Available commands: add, autoconnect, brightness, color, connect, disconnect, dynamic, effect, exit, "
-                "live, power, schedule, search, speed, time")
-
-        if cmd_parts[0] == "power":
-            if len(cmd_parts) != 2 and len(cmd_parts) != 3:
-                print("Invalid power command. Usage: power <on|off> [device_index]")
-            if cmd_parts[1] == "on":
-                if len(cmd_parts) == 2:
-                    for client in self.device.clients:
-                        await self.device.power_on(client)
-                elif len(cmd_parts) == 3:
-                    names = [client['name'] for client in self.clients]
-                    if cmd_parts[2] in names:
-                        await self.device.power_on(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']])
-                    else:
-                        await self.device.power_on(self.device.clients[int(cmd_parts[2])])
-                else:
-                    print("Invalid power command. Usage: power on [device_index]")
-            elif cmd_parts[1] == "off":
-                if len(cmd_parts) == 2:
-                    for client in self.device.clients:
-                        await self.device.power_off(client)
-                elif len(cmd_parts) == 3:
-                    names = [client['name'] for client in self.clients]
-                    if cmd_parts[2] in names:
-                        await self.device.power_off(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']])
-                    else:
-                        await self.device.power_off(self.device.clients[int(cmd_parts[2])])
-                else:
-                    print("Invalid power command. Usage: power off [device_index]")
+                "Available commands: add, animate, autoconnect, brightness, clock, color, connect, disconnect, dynamic, "
+                "effect, exit, live, pipeline, play, power, record, resync, scene, schedule, script, search, speed, stats, status, sync, time, transport",
+                file=out)
+            return
+
+        if cmd_parts[0] in self.device_commands:
+            usage = self.device_commands[cmd_parts[0]]
+            try:
+                func, args, target = self.parse_device_command(cmd_parts)
+                clients = self.select(target, out)
+            except (ValueError, IndexError, AttributeError) as e:
+                print(f"Invalid {cmd_parts[0]} command ({e}). Usage: {cmd_parts[0]} {usage}", file=out)
+                return
+            if func == self.clock.stamp:
+                self.report(await self.clock.sync(clients, push=False), out)
             else:
-                print("Invalid power command. Usage: power <on|off> [device_index]")
-        elif cmd_parts[0] == "color":
-            if len(cmd_parts) == 4:
-                for client in self.device.clients:
-                    await self.device.set_color(client, int(cmd_parts[1]), int(cmd_parts[2]), int(cmd_parts[3]))
-            elif len(cmd_parts) == 5:
-                names = [client['name'] for client in self.clients]
-                if cmd_parts[2] in names:
-                    await self.device.set_color(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']],
-                                                int(cmd_parts[1]), int(cmd_parts[2]), int(cmd_parts[3]))
-                else:
-                    await self.device.set_color(self.device.clients[int(cmd_parts[4])], int(cmd_parts[1]),
-                                                int(cmd_parts[2]), int(cmd_parts[3]))
+                self.report(await self.device.broadcast(func, *args, clients=clients), out)
+        elif cmd_parts[0] == 'connect':
+            self.report(await self.device.connect(), out)
+        elif cmd_parts[0] == 'disconnect':
+            self.report(await self.device.disconnect(), out)
+        elif cmd_parts[0] == 'add':
+            for address in cmd_parts[1:]:
+                self.device.add_address(address)
+        elif cmd_parts[0] == 'search':
+            i = 0
+            async for dev in self.device.discover():
+                self.scan_cache.update(dev.address, dev.name)
+                print(f"{i}: {dev.address}", file=out)
+                i += 1
+            self.scan_cache.save()
+        elif cmd_parts[0] == 'autoconnect':
+            known = set(self.registry.macs)
+            cached = set(self.scan_cache.fresh())
+            connecting = []
+            # strips seen recently are connected straight away, the scan only looks for the rest
+            for address in cached:
+                connecting.append(asyncio.create_task(self.device.connect_address(address)))
+            started = set(cached)
+            if not known or not known <= cached:
+                async for dev in self.device.discover(known - cached):
+                    self.scan_cache.update(dev.address, dev.name)
+                    if dev.address in started:
+                        continue
+                    started.add(dev.address)
+                    if dev.address not in self.device.device_address:
+                        print(f"Added {dev.address} to autoconnect list.", file=out)
+                    connecting.append(asyncio.create_task(self.device.connect_address(dev.address)))
+            results = await asyncio.gather(*connecting)
+            for address, error in results:
+                if error is None:
+                    self.scan_cache.update(address, self.scan_cache.devices.get(address, {}).get('name'))
+            self.scan_cache.save()
+            self.report(results, out)
+        elif cmd_parts[0] == 'animate':
+            from animation import AnimationEngine, Chase, Gradient, Rainbow, fade
+
+            usage = ("Usage: animate <rainbow|chase <r> <g> <b>|fade <r> <g> <b>|"
+                     "gradient <r> <g> <b> <r> <g> <b> ...|stop>")
+            # the new animation is checked before the running one is stopped
+            try:
+                colors = [tuple(int(c) for c in cmd_parts[i:i + 3]) for i in range(2, len(cmd_parts) - 2, 3)]
+                if any(not 0 <= c <= 255 for color in colors for c in color):
+                    raise ValueError("color values must be between 0 and 255")
+            except ValueError as e:
+                print(f"Invalid animate command ({e}). {usage}", file=out)
+                return
+            if len(cmd_parts) == 2 and cmd_parts[1] == 'rainbow':
+                animation = Rainbow()
+            elif len(cmd_parts) == 5 and cmd_parts[1] == 'chase':
+                animation = Chase(colors[0])
+            elif len(cmd_parts) == 5 and cmd_parts[1] == 'fade':
+                animation = fade((0, 0, 0), colors[0])
+            elif len(cmd_parts) >= 8 and (len(cmd_parts) - 2) % 3 == 0 and cmd_parts[1] == 'gradient':
+                animation = Gradient(colors)
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'stop':
+                animation = None
             else:
-                print("Invalid color command. Usage: color <r> <g> <b> [device_index]")
-        elif cmd_parts[0] == "effect":
-            if len(cmd_parts) == 2:
-                try:
-                    effect = Effects.from_string(cmd_parts[1])
-                except AttributeError:
-                    print("Invalid effect name. Possible effects: " + str(Effects.to_list()))
-                    return
-                for client in self.device.clients:
-                    await self.device.set_effect(client, effect)
-            elif len(cmd_parts) == 3:
+                print(f"Invalid animate command. {usage}", file=out)
+                return
+            if self.animation_task is not None:
+                self.animation_task.cancel()
+                await asyncio.gather(self.animation_task, return_exceptions=True)
+                self.tasks.remove(self.animation_task)
+                self.animation_task = None
+                stats = self.animation.stats()
+                print(f"Rendered {stats['rendered']} frames, skipped {stats['skipped']}", file=out)
+            if animation is None:
+                return
+            self.animation = AnimationEngine(self.device.stream, self.device.clients, animation)
+            self.animation_task = asyncio.create_task(self.animation.run())
+            self.tasks.append(self.animation_task)
+        elif cmd_parts[0] == 'play':
+            from track import AudioPlayback, Track, TrackPlayer
+
+            if self.play_task is not None:
+                self.play_task.cancel()
+                await asyncio.gather(self.play_task, return_exceptions=True)
+                self.tasks.remove(self.play_task)
+                self.play_task = None
+                stats = self.player.stats()
+                print(f"Played {stats['played']} frames, skipped {stats['skipped']}", file=out)
+            if len(cmd_parts) == 2 and cmd_parts[1] == 'stop':
+                return
+            try:
+                track = Track.load(cmd_parts[1])
+                audio = AudioPlayback(cmd_parts[2]) if len(cmd_parts) >= 3 and cmd_parts[2] != '-' else None
+                offset = int(cmd_parts[3]) / 1000 if len(cmd_parts) == 4 else 0.0
+                if len(cmd_parts) > 4:
+                    raise ValueError("too many arguments")
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Invalid play command ({e}). Usage: play <track> [wav|-] [offset_ms]|stop", file=out)
+                return
+            self.player = TrackPlayer(self.device.stream, self.device.clients, track, offset, audio)
+            self.play_task = asyncio.create_task(self.player.run())
+            self.tasks.append(self.play_task)
+        elif cmd_parts[0] == 'live':
+            if len(cmd_parts) in (2, 3) and cmd_parts[1] in ('start', 'beat'):
                 try:
-                    effect = Effects.from_string(cmd_parts[1])
-                except AttributeError:
-                    print("Invalid effect name. Possible effects: " + str(Effects.to_list()))
+                    clients = self.select(cmd_parts[2], out) if len(cmd_parts) == 3 else None
+                except (ValueError, IndexError) as e:
+                    print(f"Invalid live command ({e}). Usage: live <start|beat|stop> [device|group]", file=out)
                     return
-                names = [client['name'] for client in self.clients]
-                if cmd_parts[2] in names:
-                    await self.device.set_effect(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']],
-                                                 effect)
-                else:
-                    await self.device.set_effect(self.device.clients[int(cmd_parts[2])], effect)
+                live = self.audio_to_rgb if self.pipeline_inputs is None else self.pipeline_to_rgb
+                self.live_task = asyncio.create_task(live(clients, cmd_parts[1] == 'beat'))
+                self.tasks.append(self.live_task)
+            elif len(cmd_parts) in (2, 3) and cmd_parts[1] == 'stop':
+                self.live_task.cancel()
+                await self.live_task
+                self.tasks.remove(self.live_task)
+                self.live_task = None
+                shadow_stats = self.device.shadow_stats()
+                for address, stats in self.live_stream.stats().items():
+                    suppressed = shadow_stats.get(address, {}).get('suppressed', 0)
+                    print(f"{address}: sent {stats['sent']}, dropped {stats['dropped']}, errors {stats['errors']}, "
+                          f"suppressed {suppressed}, rate {stats['rate']:.1f}/s", file=out)
             else:
-                print("Invalid effect command. Usage: effect <effect_name>")
-        elif cmd_parts[0] == "dynamic":
-            if len(cmd_parts) == 2:
+                print("Invalid command. Usage: live <start|beat|stop> [device|group]", file=out)
+        elif cmd_parts[0] == 'scene':
+            from scenes import Scenes
+
+            if self.scenes is None:
+                self.scenes = Scenes(SCENES_PATH)
+            if len(cmd_parts) != 2:
+                print("Invalid scene command. Usage: scene <name>, scenes are defined in scenes.json", file=out)
+                return
+            try:
+                plan = self.scenes.compile(cmd_parts[1], self.addresses)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Invalid scene {cmd_parts[1]}: {e}", file=out)
+                return
+            self.report(await plan.apply(self.device), out)
+        elif cmd_parts[0] == 'script':
+            if len(cmd_parts) != 2:
+                print("Invalid script command. Usage: script <path>, a file with one command per line", file=out)
+                return
+            try:
+                await self.run_script(cmd_parts[1], out)
+            except (OSError, ValueError) as e:
+                print(f"Invalid script: {e}", file=out)
+        elif cmd_parts[0] == 'record':
+            from recorder import Recorder
+
+            if len(cmd_parts) == 3 and cmd_parts[1] == 'start' and self.device.recorder is None:
                 try:
-                    dynamic = DynamicModes.from_string(cmd_parts[1])
-                except AttributeError:
-                    print("Invalid dynamic name. Possible dynamics: " + str(DynamicModes.to_list()))
-                    return
-                for client in self.device.clients:
-                    await self.device.set_dynamic(client, dynamic)
-            elif len(cmd_parts) == 3:
+                    self.device.record(Recorder(cmd_parts[2]))
+                except OSError as e:
+                    print(f"Invalid record command ({e}). Usage: record <start <path>|stop>", file=out)
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'stop' and self.device.recorder is not None:
+                recorder = self.device.recorder
+                self.device.record(None)
+                recorder.close()
+                print(f"Recorded {recorder.records} writes to {recorder.path}", file=out)
+            else:
+                print("Invalid record command. Usage: record <start <path>|stop>, one recording at a time", file=out)
+        elif cmd_parts[0] == 'stats':
+            if len(cmd_parts) == 1:
+                self.print_stats(out)
+            elif len(cmd_parts) == 2 and cmd_parts[1] in ('on', 'off'):
+                metrics.enabled = cmd_parts[1] == 'on'
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'reset':
+                metrics.reset()
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'json':
+                print(json.dumps(metrics.snapshot(), indent=2), file=out)
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'prometheus':
+                print(metrics.prometheus(), end='', file=out)
+            else:
+                print("Invalid stats command. Usage: stats [on|off|reset|json|prometheus]", file=out)
+        elif cmd_parts[0] == 'status':
+            for address, health in self.device.health().items():
+                client_id = self.registry.by_mac.get(address, {}).get('id', '-')
+                rate = '' if health['stream_rate'] is None else f", stream rate {health['stream_rate']:.1f}/s"
+                print(f"{client_id}: {address} {health['state']}, reconnects {health['reconnects']}, "
+                      f"failures {health['failures']}, last error {health['last_error']}{rate}", file=out)
+            if self.device.synchronizer is not None:
+                stats = self.device.synchronizer.stats()
+                if stats['frames']:
+                    print(f"sync: {stats['frames']} frames, {stats['late']} outside the window, "
+                          f"skew p50 {stats['skew_p50'] * 1000:.1f} ms p95 {stats['skew_p95'] * 1000:.1f} ms", file=out)
+        elif cmd_parts[0] == 'sync':
+            from presentation import Synchronizer
+
+            if len(cmd_parts) in (2, 3) and cmd_parts[1] == 'on':
                 try:
-                    dynamic = DynamicModes.from_string(cmd_parts[1])
-                except AttributeError:
-                    print("Invalid dynamic name. Possible dynamics: " + str(DynamicModes.to_list()))
+                    window = int(cmd_parts[2]) / 1000 if len(cmd_parts) == 3 else 0.01
+                except ValueError as e:
+                    print(f"Invalid sync command ({e}). Usage: sync <on [window_ms]|off>", file=out)
                     return
-                names = [client['name'] for client in self.clients]
-                if cmd_parts[2] in names:
-                    await self.device.set_dynamic(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']], dynamic)
-                else:
-                    await self.device.set_dynamic(self.device.clients[int(cmd_parts[2])], dynamic)
+                self.device.synchronizer = Synchronizer(window, timeout=self.device.timeout)
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'off':
+                self.device.synchronizer = None
             else:
-                print("Invalid dynamic command. Usage: dynamic <dynamic_name>")
-        elif cmd_parts[0] == "speed":
-            if len(cmd_parts) == 2:
-                for client in self.device.clients:
-                    await self.device.set_effect_speed(client, int(cmd_parts[1]))
-            elif len(cmd_parts) == 3:
-                names = [client['name'] for client in self.clients]
-                if cmd_parts[2] in names:
-                    await self.device.set_effect_speed(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']],
-                                                  int(cmd_parts[1]))
-                else:
-                    await self.device.set_effect_speed(self.device.clients[int(cmd_parts[2])], int(cmd_parts[1]))
+                print("Invalid sync command. Usage: sync <on [window_ms]|off>", file=out)
+        elif cmd_parts[0] == 'pipeline':
+            # applies to the next live start
+            if len(cmd_parts) >= 2 and cmd_parts[1] == 'on' and all(part.isdigit() for part in cmd_parts[2:]):
+                self.pipeline_inputs = [int(part) for part in cmd_parts[2:]] or [None]
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'off':
+                self.pipeline_inputs = None
             else:
-                print("Invalid speed command. Usage: speed <speed> [device_index]")
-        elif cmd_parts[0] == "brightness":
-            if len(cmd_parts) == 2:
-                for client in self.device.clients:
-                    await self.device.set_brightness(client, int(cmd_parts[1]))
-            elif len(cmd_parts) == 3:
-                names = [client['name'] for client in self.clients]
-                if cmd_parts[2] in names:
-                    await self.device.set_brightness(self.device.clients[self.clients[names.index(cmd_parts[2])]['id']],
-                                                  int(cmd_parts[1]))
-                else:
-                    await self.device.set_brightness(self.device.clients[int(cmd_parts[2])], int(cmd_parts[1]))
+                print("Invalid pipeline command. Usage: pipeline <on [input_device ...]|off>", file=out)
+        elif cmd_parts[0] == 'clock':
+            if len(cmd_parts) == 1:
+                for address, stats in self.clock.stats().items():
+                    synced = datetime.fromtimestamp(stats['synced']).strftime('%H:%M:%S')
+                    print(f"{address}: set at {synced}, latency {stats['latency'] * 1000:.0f} ms, "
+                          f"schedules {', '.join(stats['schedules']) or 'none'}", file=out)
+                if self.clock.task is None:
+                    print("Clock sync is off, 'clock on' keeps the strips set.", file=out)
+            elif len(cmd_parts) in (2, 3) and cmd_parts[1] == 'on' and self.clock.task is None:
+                try:
+                    self.clock.interval = float(cmd_parts[2]) * 60 if len(cmd_parts) == 3 else 3600.0
+                except ValueError as e:
+                    print(f"Invalid clock command ({e}). Usage: clock [on [interval_min]|off|sync]", file=out)
+                    return
+                self.clock.start()
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'off':
+                await self.clock.stop()
+            elif len(cmd_parts) == 2 and cmd_parts[1] == 'sync':
+                self.report(await self.clock.sync(), out)
             else:
-                print("Invalid brightness command. Usage: brightness <brightness> [device_index]")
-        elif cmd_parts[0] == 'connect':
-            await self.device.connect()
-        elif cmd_parts[0] == 'disconnect':
-            await self.device.disconnect()
-        elif cmd_parts[0] == 'add':
-            for address in cmd_parts[1:]:
-                self.device.add_address(address)
-        elif cmd_parts[0] == 'time':
-            if len(cmd_parts) == 2:
-                if cmd_parts[1] == 'now':
-                    now = datetime.now()
-                    for client in self.device.clients:
-                        await self.device.set_time(client, now.hour, now.minute, now.second, now.weekday() + 1)
-                else:
-                    print("Invalid time command. Usage: time <time in h m s d|now> [device_index]")
-            elif len(cmd_parts) == 3:
-                if cmd_parts[1] == 'now':
-                    now = datetime.now()
-                    await self.device.set_time(self.device.clients[int(cmd_parts[2])], now.hour, now.minute,
-                                               now.second, now.weekday() + 1)
-            elif len(cmd_parts) == 5:
-                for client in self.device.clients:
-                    await self.device.set_time(client, int(cmd_parts[1]), int(cmd_parts[2]), int(cmd_parts[3]),
-                                               int(cmd_parts[4]))
-            elif len(cmd_parts) == 6:
-                await self.device.set_time(self.device.clients[int(cmd_parts[5])], int(cmd_parts[1]), int(cmd_parts[2]),
-                                           int(cmd_parts[3]), int(cmd_parts[4]))
+                print("Invalid clock command. Usage: clock [on [interval_min]|off|sync]", file=out)
+        elif cmd_parts[0] == 'resync':
+            # forget what the strips are believed to show, e.g. after using the remote
+            self.device.resync()
+        elif cmd_parts[0] == 'transport':
+            if len(cmd_parts) == 2 and cmd_parts[1] in ('default', 'pipelined'):
+                self.device.pipelined = cmd_parts[1] == 'pipelined'
+                print("Transport mode applies to devices connected from now on.", file=out)
             else:
-                print("Invalid time command. Usage: time <time in h m s d|now> [device_index]")
-        elif cmd_parts[0] == 'schedule':
-            if len(cmd_parts) == 6:
-                if cmd_parts[1] == 'on':
-                    for client in self.device.clients:
-                        await self.device.set_schedule_on(client, cmd_parts[3], int(cmd_parts[4]), int(cmd_parts[5]),
-                                                          cmd_parts[2] == 'enabled')
-                elif cmd_parts[1] == 'off':
-                    for client in self.device.clients:
-                        await self.device.set_schedule_off(client, cmd_parts[3], int(cmd_parts[4]), int(cmd_parts[5]),
-                                                           cmd_parts[2] == 'enabled')
-                else:
-                    print(
-                        "Invalid schedule command. Usage: schedule <on|off> <enabled|disabled> <days> <h> <m> ["
-                        "device_index]")
-            elif len(cmd_parts) == 7:
-                if cmd_parts[1] == 'on':
-                    await self.device.set_schedule_on(self.device.clients[int(cmd_parts[6])], cmd_parts[3],
-                                                      int(cmd_parts[4]), int(cmd_parts[5]), cmd_parts[2] == 'enabled')
-                elif cmd_parts[1] == 'off':
-                    await self.device.set_schedule_off(self.device.clients[int(cmd_parts[6])], cmd_parts[3],
-                                                       int(cmd_parts[4]), int(cmd_parts[5]), cmd_parts[2] == 'enabled')
-                else:
-                    print("Invalid schedule command. Usage: schedule <on|off> <enabled|disabled> <days> <h> <m> ["
-                          "device_index]")
-        elif cmd_parts[0] == 'search':
-            devices = await self.device.search()
-            for i, dev in enumerate(devices):
-                print(f"{i}: {dev.address}")
-        elif cmd_parts[0] == 'autoconnect':
-            devices = await self.device.search()
-            for dev in devices:
-                self.device.add_address(dev.address)
-                print(f"Added {dev.address} to autoconnect list.")
-            await self.device.connect()
-            if len(self.clients) != 0:
-                for client in self.clients:
-                    client['id'] = self.device.device_address.index(client['mac']) if client[
-                                                                                          'mac'] in self.device.device_address else -1
-        elif cmd_parts[0] == 'live':
-            if len(cmd_parts) == 2:
-                if cmd_parts[1] == 'start':
-                    self.live_task = asyncio.create_task(self.audio_to_rgb())
-                    self.tasks.append(self.live_task)
-                elif cmd_parts[1] == 'stop':
-                    self.live_task.cancel()
-                    await self.live_task
-                    self.tasks.remove(self.live_task)
-                    self.live_task = None
-                else:
-                    print("Invalid command. Usage: live <start|stop> [device_index]")
-            elif len(cmd_parts) == 3:
-                if cmd_parts[1] == 'start':
-                    self.live_task = asyncio.create_task(self.audio_to_rgb(int(cmd_parts[2])))
-                    self.tasks.append(self.live_task)
-                elif cmd_parts[1] == 'stop':
-                    self.live_task.cancel()
-                    await self.live_task
-                    self.tasks.remove(self.live_task)
-                    self.live_task = None
-                else:
-                    print("Invalid command. Usage: live <start|stop> [device_index]")
+                print("Invalid transport command. Usage: transport <default|pipelined>", file=out)
         elif cmd_parts[0] == 'exit':
             await self.device.disconnect()
             exit(0)
         else:
-            print("Invalid command.")
+            print("Invalid command.", file=out)
+
+
+async def run_once(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog='main.py', description='Run a single command and exit. '
+                                     'Without arguments the interactive prompt starts.')
+    parser.add_argument('command', nargs='+', help="e.g. 'power off' or 'color 255 0 0'")
+    parser.add_argument('--device', action='append', default=[],
+                        help='id, name or MAC from clients.json, can be repeated. Defaults to every known device')
+    parser.add_argument('--group', action='append', default=[],
+                        help='group or tag from clients.json, can be repeated')
+    args = parser.parse_intermixed_args(argv)
+
+    cli = CLI()
+    cmd_parts = ' '.join(args.command).split()
+    if not cli.connects(cmd_parts):
+        await cli.process_command(' '.join(cmd_parts))
+        return 0
+    named = args.device + args.group
+    if cmd_parts[0] in cli.device_commands:
+        # a target in the command itself, like 'power off Room', narrows the strips down like --device does
+        try:
+            _, _, target = cli.parse_device_command(cmd_parts)
+        except (ValueError, IndexError, AttributeError):
+            await cli.process_command(' '.join(cmd_parts))  # prints the usage
+            return 2
+        named += [target] if target is not None else []
+    try:
+        targets = []
+        for target in named:
+            addresses = cli.registry.resolve(target)
+            if addresses is None:
+                raise ValueError(f"Unknown device or group: {target}")
+            targets += addresses
+        targets = list(dict.fromkeys(targets)) if targets else cli.registry.macs
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
 
+    # only the targeted strips are connected, and commands go to all of them
+    for address in targets:
+        cli.device.add_address(address)
+    results = await cli.device.connect()
+    cli.report(results)
+    try:
+        await cli.process_command(' '.join(cmd_parts))
+    finally:
+        await cli.device.disconnect()
+    return 1 if any(error is not None for _, error in results) else 0
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(asyncio.run(run_once(sys.argv[1:])))
     cli = CLI()
     asyncio.run(cli.run())
@@ -0,0 +1,142 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+
+PREFIX = 'elkble_'
+BUCKETS = tuple(0.00025 * 2 ** i for i in range(14))  # 0.25 ms to 2 s
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets  # upper bounds, a last bucket takes everything above
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        # upper bound of the bucket the quantile falls in, inf when it is above the last bound
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, value: int = 1):
+        self.value += value
+
+
+class Metrics:
+    # Instruments are created once and kept by whoever updates them, so the hot path is an attribute
+    # check and a bucket lookup. Values that already live somewhere else, like queue depths or reconnect
+    # counts, are read by collectors only when somebody asks for the metrics.
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.histograms: dict[tuple, Histogram] = {}
+        self.counters: dict[tuple, Counter] = {}
+        self.collectors = []  # callables returning (name, labels, kind, value) tuples, kind is gauge or counter
+
+    @staticmethod
+    def key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        return self.histograms.setdefault(self.key(name, labels), Histogram())
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self.counters.setdefault(self.key(name, labels), Counter())
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.__init__(histogram.buckets)
+        for counter in self.counters.values():
+            counter.value = 0
+
+    def collected(self) -> list[tuple]:
+        samples = [(name, dict(labels), 'counter', counter.value) for (name, labels), counter in self.counters.items()]
+        for collector in self.collectors:
+            samples.extend(collector())
+        return samples
+
+    def snapshot(self) -> dict:
+        histograms = {}
+        for (name, labels), histogram in self.histograms.items():
+            if histogram.count:
+                histograms.setdefault(name, []).append({
+                    'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95), 'p99': histogram.quantile(0.99),
+                })
+        values = {}
+        for name, labels, kind, value in self.collected():
+            values.setdefault(name, []).append({'labels': labels, 'value': value})
+        return {'time': time.time(), 'histograms': histograms, 'values': values}
+
+    def prometheus(self) -> str:
+        def format_labels(labels: dict, **extra) -> str:
+            labels = {**labels, **extra}
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+        # every sample of a metric has to follow its TYPE line
+        families: dict[str, tuple[str, list[str]]] = {}
+        for name, labels, kind, value in self.collected():
+            families.setdefault(name, (kind, []))[1].append(f'{PREFIX}{name}{format_labels(labels)} {value}')
+        for (name, labels), histogram in self.histograms.items():
+            labels = dict(labels)
+            lines = families.setdefault(name, ('histogram', []))[1]
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{PREFIX}{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {histogram.count}')
+
+        lines = []
+        for name, (kind, samples) in families.items():
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+            lines += samples
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # just enough HTTP for a Prometheus scrape, every path answers with the metrics
+        try:
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            body = self.prometheus().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 9464):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def dump(self, path: str, interval: float = 10.0):
+        # rewrite the file atomically so readers never see half a snapshot
+        while True:
+            await asyncio.sleep(interval)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + '.tmp', path)
+
+
+metrics = Metrics()
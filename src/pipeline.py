@@ -0,0 +1,290 @@
+import asyncio
+import multiprocessing
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from audio import CHUNK_SIZE, SR, SpectrumAnalyzer, Zone, ZoneMapper
+from beat import BeatDetector
+from capture import RingBuffer
+from metrics import metrics
+
+RESULT_SLOTS = 64
+
+Analyzed = namedtuple('Analyzed', ['input', 'time', 'colors', 'beat', 'bpm'])
+
+
+class SharedRing(RingBuffer):
+    # The RingBuffer of capture.py in shared memory, so a producer in one process and a consumer in another
+    # exchange data without pickling. A header in front of the data holds the number of items written, updated
+    # only after the copy, and the number of windows the consumer skipped because it fell behind.
+    HEADER = 2
+
+    def __init__(self, capacity: int, shape: tuple = (), dtype=np.int16, name: str = None):
+        dtype = np.dtype(dtype)
+        size = self.HEADER * 8 + capacity * int(np.prod(shape, dtype=int)) * dtype.itemsize
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name, create=self.owner, size=size if self.owner else 0)
+        self.header = np.ndarray(self.HEADER, np.int64, self.memory.buf)
+        self.data = np.ndarray((capacity, *shape), dtype, self.memory.buf, offset=self.HEADER * 8)
+        self.capacity = capacity
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def written(self) -> int:
+        return int(self.header[0])
+
+    @written.setter
+    def written(self, value: int):
+        self.header[0] = value
+
+    @property
+    def overruns(self) -> int:
+        return int(self.header[1])
+
+    @overruns.setter
+    def overruns(self, value: int):
+        self.header[1] = value
+
+    def spec(self) -> tuple:
+        # what another process needs to attach to the same buffer
+        return self.memory.name, self.capacity, self.data.shape[1:], self.data.dtype
+
+    @classmethod
+    def attach(cls, spec: tuple) -> 'SharedRing':
+        name, capacity, shape, dtype = spec
+        return cls(capacity, shape, dtype, name)
+
+    def close(self):
+        # the arrays point into the mapping, it cannot be closed while they exist
+        del self.header, self.data
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def result_dtype(zones: int) -> np.dtype:
+    return np.dtype([('time', '<f8'), ('beat', '<f8'), ('bpm', '<f8'), ('seconds', '<f8'),
+                     ('colors', 'u1', (zones, 3))])
+
+
+class Analysis:
+    # What a worker does with each window. It is built in the parent and pickled once into the worker, a subclass
+    # can do more per window, e.g. a finer FFT or another detector.
+    def __init__(self, zones: list[Zone], window: int = CHUNK_SIZE, hop: int = CHUNK_SIZE // 2, rate: int = SR):
+        self.zones = len(zones)
+        self.analyzer = SpectrumAnalyzer(window, rate)
+        self.mapper = ZoneMapper(zones, window, rate, hop / rate)
+        self.detector = BeatDetector(window // 2)
+
+    def analyze(self, samples: np.ndarray, timestamp: float, result: np.ndarray):
+        magnitude = self.analyzer.spectrum(samples)
+        result['colors'] = self.mapper.update(magnitude)
+        beat = self.detector.update(magnitude, timestamp)
+        result['beat'] = 0.0 if beat is None else beat.strength
+        result['bpm'] = np.nan if beat is None or beat.bpm is None else beat.bpm
+
+
+class Input:
+    def __init__(self, source, zones: list[Zone], window: int = CHUNK_SIZE, hop: int = CHUNK_SIZE // 2,
+                 analysis: Analysis = None, capacity: int = None):
+        self.source = source
+        self.window = window
+        self.hop = hop
+        self.analysis = analysis or Analysis(zones, window, hop, source.rate)
+        self.capacity = capacity or window * 16
+
+
+def capture_worker(sources: list, audio_specs: list[tuple], wakes: list, stop):
+    # All inputs are captured in one process, the callbacks only copy into the shared rings and wake the analysis.
+    rings = [SharedRing.attach(spec) for spec in audio_specs]
+    ended = []
+
+    def start(source, ring: SharedRing, wake):
+        def on_samples(samples: np.ndarray):
+            ring.write(samples)
+            wake.send_bytes(b'')
+
+        source.start(on_samples, lambda: ended.append(source))
+
+    for source, ring, wake in zip(sources, rings, wakes):
+        start(source, ring, wake)
+    try:
+        while not stop.wait(0.1) and len(ended) < len(sources):
+            pass
+    except KeyboardInterrupt:
+        pass  # the parent stops the pipeline
+    finally:
+        for source in sources:
+            if source not in ended:
+                source.stop()
+        # closing the pipes is what ends the analysis workers
+        for wake in wakes:
+            wake.close()
+
+
+def analysis_worker(analysis: Analysis, window: int, hop: int, rate: int, audio_spec: tuple, results_spec: tuple,
+                    wake, notify):
+    audio = SharedRing.attach(audio_spec)
+    results = SharedRing.attach(results_spec)
+    samples = np.empty(window, dtype=np.int16)
+    result = np.zeros(1, dtype=results.data.dtype)
+    position = 0
+    finished = False
+    try:
+        while not finished:
+            try:
+                wake.recv_bytes()
+            except EOFError:
+                finished = True
+            except KeyboardInterrupt:
+                return
+            analyzed = False
+            while audio.written - position >= window:
+                if audio.written - position > audio.capacity - window:
+                    # the capture lapped us, continue from the newest full window like Capture.windows does
+                    audio.overruns += 1
+                    position = audio.written - window
+                audio.read(position, samples)
+                started = time.perf_counter()
+                result['time'] = (position + window) / rate
+                analysis.analyze(samples, result['time'][0], result[0])
+                result['seconds'] = time.perf_counter() - started
+                results.write(result)
+                position += hop
+                analyzed = True
+            if analyzed:
+                notify.send_bytes(b'')
+    finally:
+        notify.close()
+
+
+class Pipeline:
+    # Capture and analysis run in worker processes, one capture process for all inputs and an analysis process per
+    # input so that they use separate cores. Audio and results go through shared memory, the pipes only carry
+    # wake-ups, and the event loop reads the small colors and beats of the newest windows.
+    def __init__(self, inputs: list[Input], context: str = 'spawn'):
+        self.inputs = inputs
+        # forking a process that runs an event loop, Bluetooth threads and maybe PortAudio can deadlock the child
+        self.context = multiprocessing.get_context(context)
+        self.audio = []
+        self.results = []
+        self.processes = []
+        self.connections = []
+        self.stop_event = None
+        self.ready = asyncio.Event()
+        self.finished = set()
+        self.seen = [0] * len(inputs)
+        self.overruns = [0] * len(inputs)
+        self.analysis_histograms = [metrics.histogram('analysis_seconds', input=str(i)) for i in range(len(inputs))]
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = self.context.Event()
+        wakes = []
+        for index, audio_input in enumerate(self.inputs):
+            audio = SharedRing(audio_input.capacity)
+            results = SharedRing(RESULT_SLOTS, dtype=result_dtype(audio_input.analysis.zones))
+            self.audio.append(audio)
+            self.results.append(results)
+            wake_reader, wake_writer = self.context.Pipe(duplex=False)
+            notify_reader, notify_writer = self.context.Pipe(duplex=False)
+            wakes.append(wake_writer)
+            self.processes.append(self.context.Process(
+                target=analysis_worker, name=f'elkble-analysis-{index}', daemon=True,
+                args=(audio_input.analysis, audio_input.window, audio_input.hop, audio_input.source.rate,
+                      audio.spec(), results.spec(), wake_reader, notify_writer)))
+            self.processes[-1].start()
+            # the workers hold their own ends now, closing ours lets them see the end of the stream
+            wake_reader.close()
+            notify_writer.close()
+            self.connections.append(notify_reader)
+            self.loop.add_reader(notify_reader.fileno(), self.on_notify, index)
+
+        self.processes.append(self.context.Process(
+            target=capture_worker, name='elkble-capture', daemon=True,
+            args=([audio_input.source for audio_input in self.inputs], [audio.spec() for audio in self.audio], wakes,
+                  self.stop_event)))
+        self.processes[-1].start()
+        for wake in wakes:
+            wake.close()
+
+    def on_notify(self, index: int):
+        connection = self.connections[index]
+        try:
+            while connection.poll():
+                connection.recv_bytes()
+        except (EOFError, OSError):
+            self.loop.remove_reader(connection.fileno())
+            self.finished.add(index)
+        self.ready.set()
+
+    def join(self):
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        self.join()
+        self.close()
+
+    def close(self):
+        for index, connection in enumerate(self.connections):
+            if index not in self.finished:
+                self.loop.remove_reader(connection.fileno())
+            connection.close()
+        self.overruns = [audio.overruns for audio in self.audio]
+        for ring in self.audio + self.results:
+            ring.close()
+        self.audio, self.results = [], []
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        # the workers take a moment to wind down, the loop keeps running meanwhile
+        self.stop_event.set()
+        await self.loop.run_in_executor(None, self.join)
+        self.close()
+
+    def take(self, index: int) -> Analyzed | None:
+        # newest result of an input, with the strongest beat of the ones that are skipped over
+        results = self.results[index]
+        written = results.written
+        if written == self.seen[index]:
+            return None
+        first = max(self.seen[index], written - results.capacity)
+        slots = np.arange(first, written) % results.capacity
+        beats = results.data['beat'][slots]
+        strongest = slots[beats.argmax()]
+        newest = results.data[slots[-1]].copy()
+        bpm = results.data['bpm'][strongest]
+        if metrics.enabled:
+            for seconds in results.data['seconds'][slots]:
+                self.analysis_histograms[index].observe(seconds)
+        self.seen[index] = written
+        return Analyzed(index, float(newest['time']), newest['colors'], float(beats.max()),
+                        None if np.isnan(bpm) else float(bpm))
+
+    async def analyzed(self):
+        while True:
+            self.ready.clear()
+            pending = [result for result in map(self.take, range(len(self.inputs))) if result is not None]
+            for result in pending:
+                yield result
+            if not pending:
+                if len(self.finished) == len(self.inputs):
+                    return
+                await self.ready.wait()
+
+    def collect(self) -> list[tuple]:
+        overruns = [audio.overruns for audio in self.audio] or self.overruns
+        return [('pipeline_overruns', {'input': str(index)}, 'counter', value) for index, value in enumerate(overruns)]
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from collections import deque
+
+
+class Synchronizer:
+    # Times the sends of one change so that every strip shows it at about the same moment. Each device is
+    # sent its write early by its own expected latency, which is learned from the writes made here.
+    def __init__(self, window: float = 0.01, initial: float = 0.05, samples: int = 9, timeout: float = 10.0,
+                 history: int = 256):
+        self.window = window  # skew the presentation aims for, in seconds
+        self.initial = initial  # latency assumed for a device that was not written to yet
+        self.samples_kept = samples  # latencies per device the estimate is the median of
+        self.timeout = timeout
+        self.samples: dict[str, deque] = {}
+        self.latency: dict[str, float] = {}
+        self.spread: dict[str, float] = {}  # spread of the recent latencies
+        self.skews = deque(maxlen=history)  # spread of the completion times of the last frames
+        self.frames = 0
+        self.late = 0  # frames that missed the window
+
+    def observe(self, address: str, latency: float):
+        samples = self.samples.get(address)
+        if samples is None:
+            samples = self.samples[address] = deque(maxlen=self.samples_kept)
+        samples.append(latency)
+        # the median shrugs off the odd write that was held up, a mean would carry it into the next frames
+        ordered = sorted(samples)
+        self.latency[address] = ordered[len(ordered) // 2]
+        self.spread[address] = ordered[-1] - ordered[0]
+
+    def estimate(self, address: str) -> float:
+        return self.latency.get(address, self.initial)
+
+    @staticmethod
+    async def sleep_until(deadline: float, spin: float = 0.002):
+        # timers of the event loop fire a millisecond or more late, so the last stretch yields in a loop instead
+        if deadline - time.monotonic() > spin:
+            await asyncio.sleep(deadline - time.monotonic() - spin)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0)
+
+    async def present(self, func, clients: list, *args) -> list[tuple[object, Exception | None]]:
+        # func(client, *args) is awaited for every client, e.g. ELKDevice.set_color. Results come back
+        # like ELKDevice.fan_out, there is no concurrency limit because the sends have to overlap.
+        estimates = [self.estimate(client.address) for client in clients]
+        start = time.monotonic()
+        target = start + max(estimates, default=0.0)
+        completed = []
+
+        async def run(client, estimate: float):
+            await self.sleep_until(target - estimate)
+            sent = time.monotonic()
+            try:
+                result = await asyncio.wait_for(func(client, *args), self.timeout)
+            except Exception as e:
+                return client, e
+            done = time.monotonic()
+            # writes the shadow layer skipped return False at once and say nothing about the link
+            if result is not False:
+                self.observe(client.address, done - sent)
+                completed.append(done)
+            return client, None
+
+        results = list(await asyncio.gather(*(run(client, estimate) for client, estimate in zip(clients, estimates))))
+        if completed:
+            skew = max(completed) - min(completed)
+            self.skews.append(skew)
+            self.frames += 1
+            self.late += skew > self.window
+        return results
+
+    @property
+    def skew(self) -> float | None:
+        return self.skews[-1] if self.skews else None
+
+    def stats(self) -> dict:
+        skews = sorted(self.skews)
+        return {
+            'frames': self.frames,
+            'late': self.late,
+            'skew_p50': skews[len(skews) // 2] if skews else None,
+            'skew_p95': skews[int(len(skews) * 0.95)] if skews else None,
+            'latency': dict(self.latency),
+            'spread': dict(self.spread),
+        }
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import struct
+import time
+from collections import namedtuple
+
+from elkble import DeviceUnavailable, ELKDevice, Priority
+
+MAGIC = b'ELKREC1\n'
+# MAC, monotonic enqueue time, enqueue to completion latency, outcome, priority, frame: 29 bytes per write
+RECORD = struct.Struct('<6sdfBB9s')
+
+Record = namedtuple('Record', ['address', 'time', 'latency', 'outcome', 'priority', 'frame'])
+
+
+class Outcome:
+    ok = 0
+    suppressed = 1  # the shadow layer skipped a write that would not have changed anything
+    error = 2
+    unavailable = 3  # the device was not connected
+    cancelled = 4  # timed out or cancelled before it completed
+
+    names = ('ok', 'suppressed', 'error', 'unavailable', 'cancelled')
+
+    @classmethod
+    def of(cls, result) -> int:
+        if isinstance(result, DeviceUnavailable):
+            return cls.unavailable
+        if isinstance(result, (asyncio.CancelledError, asyncio.TimeoutError)):
+            return cls.cancelled
+        if isinstance(result, BaseException):
+            return cls.error
+        return cls.suppressed if result is False else cls.ok
+
+
+class Recorder:
+    def __init__(self, path: str, buffering: int = 64 * 1024):
+        self.path = path
+        # a recording is one session, the monotonic times of two sessions would not line up
+        self.file = open(path, 'wb', buffering=buffering)
+        self.file.write(MAGIC)
+        self.records = 0
+
+    def record(self, address: str, frame, priority: int, enqueued: float, result):
+        # result is what the write returned or the exception it raised
+        latency = time.monotonic() - enqueued
+        self.file.write(RECORD.pack(bytes.fromhex(address.replace(':', '')), enqueued, latency,
+                                    Outcome.of(result), priority, bytes(frame)))
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read(path: str) -> list[Record]:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a recording")
+        data = f.read()
+    # a recording that was cut off mid-write ends with a partial record, which is left out
+    data = data[:len(data) - len(data) % RECORD.size]
+    return [Record(':'.join(f'{b:02X}' for b in mac), enqueued, latency, outcome, priority, frame)
+            for mac, enqueued, latency, outcome, priority, frame in RECORD.iter_unpack(data)]
+
+
+def summarize(records: list[Record]) -> dict[str, dict]:
+    devices = {}
+    for record in records:
+        devices.setdefault(record.address, []).append(record)
+    summary = {}
+    for address, device_records in devices.items():
+        latencies = sorted(record.latency for record in device_records if record.outcome == Outcome.ok)
+        span = device_records[-1].time - device_records[0].time
+        summary[address] = {
+            'writes': len(device_records),
+            'rate': len(device_records) / span if span > 0 else None,
+            'outcomes': {name: sum(record.outcome == i for record in device_records)
+                         for i, name in enumerate(Outcome.names)},
+            'p50': latencies[len(latencies) // 2] if latencies else None,
+            'p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        }
+    return summary
+
+
+async def replay(device: ELKDevice, records: list[Record], speed: float = 1.0) -> list[Record]:
+    # speed 1 keeps the original timing and 2 plays twice as fast. Speed 0 sends as fast as possible,
+    # each device on its own in the recorded order. Returns what happened to every write this time.
+    results = []
+
+    async def send(record: Record):
+        enqueued = time.monotonic()
+        try:
+            client = device.pool.get(record.address)
+            if client is None:
+                raise DeviceUnavailable(f"{record.address} is not connected")
+            func = device.stream if record.priority == Priority.stream else device.write
+            result = await func(client, record.frame)
+        except Exception as e:
+            result = e
+        results.append(record._replace(time=enqueued, latency=time.monotonic() - enqueued,
+                                       outcome=Outcome.of(result)))
+
+    if not records:
+        return results
+    if speed == 0:
+        devices = {}
+        for record in records:
+            devices.setdefault(record.address, []).append(record)
+
+        async def send_all(device_records: list[Record]):
+            for record in device_records:
+                await send(record)
+
+        await asyncio.gather(*(send_all(device_records) for device_records in devices.values()))
+        return results
+
+    origin = records[0].time
+    start = time.monotonic()
+    tasks = []
+    for record in records:
+        delay = (record.time - origin) / speed - (time.monotonic() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(record)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def print_summary(records: list[Record]):
+    def ms(value):
+        return '-' if value is None else f"{value * 1000:.1f}"
+
+    for address, stats in summarize(records).items():
+        outcomes = ', '.join(f"{name} {count}" for name, count in stats['outcomes'].items() if count)
+        rate = '-' if stats['rate'] is None else f"{stats['rate']:.1f}"
+        print(f"{address}: {stats['writes']} writes at {rate}/s ({outcomes}), latency p50 {ms(stats['p50'])} ms, "
+              f"p95 {ms(stats['p95'])} ms, max {ms(stats['max'])} ms")
+
+
+async def run_replay(args) -> int:
+    records = read(args.recording)
+    addresses = list(dict.fromkeys(record.address for record in records))
+    device = ELKDevice()
+    device.shadowed = False  # every recorded write is sent again, repeated frames are part of the load
+    if args.fake:
+        from emulator import Fleet
+
+        fleet = Fleet(latency=args.latency)
+        for address in addresses:
+            fleet.add(address)
+        device.client_factory = fleet.client
+    if args.record:
+        device.record(Recorder(args.record))
+    for address in addresses:
+        device.add_address(address)
+
+    for address, error in await device.connect():
+        if error is not None:
+            print(f"{address}: {error!r}")
+    start = time.monotonic()
+    try:
+        results = await replay(device, records, 0 if args.fast else args.speed)
+    finally:
+        await device.disconnect()
+        if device.recorder is not None:
+            device.recorder.close()
+    original = records[-1].time - records[0].time if records else 0
+    print(f"Replayed {len(results)} writes in {time.monotonic() - start:.2f} s, recorded over {original:.2f} s")
+    print_summary(results)
+    return 1 if any(result.outcome in (Outcome.error, Outcome.unavailable) for result in results) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and replay recordings of the writes sent to the strips.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary = commands.add_parser('summary', help='per device write counts, outcomes and latencies')
+    summary.add_argument('recording')
+    replay_parser = commands.add_parser('replay', help='send a recording to the strips again')
+    replay_parser.add_argument('recording')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='1 keeps the original timing')
+    replay_parser.add_argument('--fast', action='store_true', help='send as fast as the strips take it')
+    replay_parser.add_argument('--fake', action='store_true', help='replay against emulated strips')
+    replay_parser.add_argument('--latency', type=float, default=0.01, help='write latency of the emulated strips')
+    replay_parser.add_argument('--record', help='record the replay itself to this file')
+    args = parser.parse_args()
+
+    if args.command == 'summary':
+        print_summary(read(args.recording))
+        return 0
+    return asyncio.run(run_replay(args))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,134 @@
+import json
+import os
+
+
+class Registry:
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.clients: list[dict] = []
+        self.by_name: dict[str, str] = {}
+        self.by_mac: dict[str, dict] = {}
+        self.by_id: dict[int, str] = {}
+        self.groups: dict[str, list[str]] = {}  # group or tag name -> MACs, in clients.json order
+        self.zones: dict[str, dict] = {}  # named spectral mappings that clients can refer to
+        self.schedules: dict[str, dict] = {}  # device, group or tag -> on/off schedule the strips should keep
+        self.refresh()
+
+    def load(self):
+        with open(self.path) as f:
+            config = json.load(f)
+
+        clients = config.get('clients', [])
+        by_name, by_mac, by_id, groups = {}, {}, {}, {}
+        for client in clients:
+            mac = client['mac'].upper()
+            by_name[client['name']] = mac
+            by_mac[mac] = client
+            if 'id' in client:
+                by_id[client['id']] = mac
+            for tag in client.get('tags', []):
+                groups.setdefault(tag, []).append(mac)
+
+        # explicit groups may list names, MACs, tags or other groups
+        definitions = config.get('groups', {})
+
+        def expand(name: str, seen: tuple) -> list[str]:
+            if name in seen:
+                raise ValueError(f"Group {name} contains itself")
+            members = []
+            for member in definitions[name]:
+                if member in definitions:
+                    members += expand(member, seen + (name,))
+                elif member in groups:
+                    members += groups[member]
+                elif member in by_name:
+                    members.append(by_name[member])
+                elif member.upper() in by_mac:
+                    members.append(member.upper())
+                else:
+                    raise ValueError(f"Unknown member {member} in group {name}")
+            return list(dict.fromkeys(members))
+
+        for name in definitions:
+            groups[name] = expand(name, ())
+
+        zones = config.get('zones', {})
+        configured = list(zones.items())
+        for client in clients:
+            zone = client.get('zone')
+            if isinstance(zone, str) and zone not in zones:
+                raise ValueError(f"Unknown zone {zone} for {client['name']}")
+            if zone is not None and not isinstance(zone, str):
+                configured.append((client['name'], zone))
+        if configured:
+            # a zone that cannot be built would otherwise only fail once live mode maps the spectrum
+            from audio import Zone
+
+            for name, zone in configured:
+                try:
+                    Zone.from_dict(zone)
+                except (TypeError, ValueError, KeyError) as e:
+                    raise ValueError(f"Invalid zone {name}: {e!r}") from None
+
+        schedules = config.get('schedules', {})
+        for target in schedules:
+            if target not in groups and target not in by_name and target.upper() not in by_mac:
+                raise ValueError(f"Unknown device or group {target} in schedules")
+
+        self.clients, self.by_name, self.by_mac, self.by_id, self.groups = clients, by_name, by_mac, by_id, groups
+        self.zones = zones
+        self.schedules = schedules
+
+    def refresh(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.load()
+        self.mtime = mtime
+        return True
+
+    @property
+    def macs(self) -> list[str]:
+        return list(self.by_mac)
+
+    def names(self) -> list[str]:
+        return list(self.by_name) + list(self.groups)
+
+    def name(self, mac: str) -> str | None:
+        client = self.by_mac.get(mac.upper())
+        return None if client is None else client['name']
+
+    def zone(self, mac: str) -> dict | None:
+        client = self.by_mac.get(mac.upper())
+        zone = None if client is None else client.get('zone')
+        return self.zones[zone] if isinstance(zone, str) else zone
+
+    def input(self, mac: str) -> int:
+        # which audio input of the pipeline drives the strip, the first one unless it says otherwise
+        client = self.by_mac.get(mac.upper())
+        return 0 if client is None else int(client.get('input', 0))
+
+    def schedule(self, mac: str) -> dict:
+        # the "on" and "off" entries that apply to the strip, later targets in schedules override earlier ones
+        schedule = {}
+        for target, entries in self.schedules.items():
+            if mac.upper() in self.resolve(target):
+                schedule.update(entries)
+        return schedule
+
+    def resolve(self, target: str) -> list[str] | None:
+        # a number is the id of a client, so it names the same strip in every session
+        if target.isdigit():
+            mac = self.by_id.get(int(target))
+            return None if mac is None else [mac]
+        if target in self.groups:
+            return self.groups[target]
+        if target in self.by_name:
+            return [self.by_name[target]]
+        if target.upper() in self.by_mac or target.count(':') == 5:
+            return [target.upper()]
+        return None
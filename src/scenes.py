@@ -0,0 +1,128 @@
+import asyncio
+import colorsys
+import json
+import os
+
+import codec
+from elkble import CHARACTERISTIC_UUID, DeviceUnavailable, DynamicModes, Effects, Days, ELKDevice, ShadowClient
+
+# the frame each device command of the CLI sends, so commands can be compiled instead of sent one by one
+ENCODERS = {
+    ELKDevice.power_on: lambda: codec.power(True),
+    ELKDevice.power_off: lambda: codec.power(False),
+    ELKDevice.set_brightness: codec.brightness,
+    ELKDevice.set_color: codec.color,
+    ELKDevice.set_effect: codec.effect,
+    ELKDevice.set_dynamic: codec.dynamic,
+    ELKDevice.set_effect_speed: codec.speed,
+    ELKDevice.set_time: codec.time,
+    ELKDevice.set_schedule_on: lambda days, hour, minute, enable: codec.schedule(True, Days.from_string(days), hour,
+                                                                                minute, enable),
+    ELKDevice.set_schedule_off: lambda days, hour, minute, enable: codec.schedule(False, Days.from_string(days), hour,
+                                                                                 minute, enable),
+}
+
+
+class Plan:
+    # the frames a batch of commands leaves for each device. A later frame replaces an earlier one that sets
+    # the same thing, so a script that changes the color three times sends one color frame.
+    def __init__(self):
+        self.frames: dict[str, dict[str, bytes]] = {}
+
+    def __len__(self):
+        return sum(len(frames) for frames in self.frames.values())
+
+    def add(self, addresses: list[str], frame: bytes):
+        key = ShadowClient.key(codec.decode(frame)[0]) or 'time'
+        for address in addresses:
+            frames = self.frames.setdefault(address, {})
+            frames.pop(key, None)
+            frames[key] = frame
+
+    async def apply(self, device: ELKDevice) -> list[tuple[str, Exception | None]]:
+        # The frames of one device go out back to back as writes without response, a power off last so that it is
+        # not undone. The link delivers them in the order they were sent, so none has to wait for the one before
+        # it and a scene takes about one round trip. All devices at once, they are connected already and the
+        # connect limit of max_concurrency does not apply to writes.
+        async def apply_device(address: str):
+            client = device.pool.get(address)
+            if client is None:
+                raise DeviceUnavailable(f"{address} is not connected")
+            frames = list(self.frames[address].values())
+            off = codec.power(False)
+            frames = [frame for frame in frames if frame != off] + [frame for frame in frames if frame == off]
+            # the earlier frames have landed when the last one has, waiting for all of them costs nothing extra
+            # and reports their errors too
+            await asyncio.gather(*(client.write_gatt_char(CHARACTERISTIC_UUID, frame, response=False)
+                                   for frame in frames))
+
+        return await device.fan_out(apply_device, list(self.frames), concurrency=max(len(self.frames), 1))
+
+
+def encode(func, args: list) -> bytes:
+    return ENCODERS[func](*args)
+
+
+def parse_color(value) -> tuple[int, int, int]:
+    # [r, g, b] or {"h": .., "s": .., "v": ..} like the zone palettes
+    if isinstance(value, dict):
+        r, g, b = colorsys.hsv_to_rgb(value['h'] % 1.0, value.get('s', 1.0), value.get('v', 1.0))
+        return int(r * 255), int(g * 255), int(b * 255)
+    r, g, b = value
+    return int(r), int(g), int(b)
+
+
+def settings_frames(settings: dict) -> list[bytes]:
+    unknown = set(settings) - {'power', 'color', 'effect', 'dynamic', 'brightness', 'speed'}
+    if unknown:
+        raise ValueError(f"Unknown scene settings: {', '.join(sorted(unknown))}")
+    frames = []
+    if 'power' in settings:
+        frames.append(codec.power(settings['power'] in (True, 'on')))
+    if 'color' in settings:
+        frames.append(codec.color(*parse_color(settings['color'])))
+    try:
+        if 'effect' in settings:
+            frames.append(codec.effect(Effects.from_string(settings['effect'])))
+        if 'dynamic' in settings:
+            frames.append(codec.dynamic(DynamicModes.from_string(settings['dynamic'])))
+    except AttributeError as e:
+        raise ValueError(f"Unknown effect or dynamic mode: {e}") from None
+    if 'brightness' in settings:
+        frames.append(codec.brightness(int(settings['brightness'])))
+    if 'speed' in settings:
+        frames.append(codec.speed(int(settings['speed'])))
+    return frames
+
+
+class Scenes:
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.scenes: dict[str, dict] = {}
+
+    def refresh(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.scenes, self.mtime = {}, None
+            return False
+        if mtime == self.mtime:
+            return False
+        with open(self.path) as f:
+            self.scenes = json.load(f).get('scenes', {})
+        self.mtime = mtime
+        return True
+
+    def compile(self, name: str, resolve) -> Plan:
+        # resolve(target) gives the addresses of a device, group or tag. Targets are applied in the
+        # order they are listed, so a device listed after its group overrides the group's settings.
+        self.refresh()
+        if name not in self.scenes:
+            raise ValueError(f"Unknown scene {name}")
+        plan = Plan()
+        for target, settings in self.scenes[name].items():
+            addresses = resolve(target)
+            for frame in settings_frames(settings):
+                plan.add(addresses, frame)
+        return plan
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from bleak import BleakClient
+
+from metrics import metrics
+
+
+class RateController:
+    def __init__(self, rate: float = 20.0, min_rate: float = 2.0, max_rate: float = 60.0, increase: float = 3.0,
+                 decrease: float = 0.7, tolerance: float = 1.5):
+        self.rate = rate  # frames per second this device is currently allowed
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.baseline = None  # lowest write latency seen recently, i.e. the link without queueing
+        self.latency = None
+        self.hold = 0
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.rate
+
+    def backoff(self):
+        # back off at most once per few writes, the smoothed latency needs time to react
+        if self.hold == 0:
+            self.rate = max(self.rate * self.decrease, self.min_rate)
+            self.hold = 4
+
+    def on_sent(self, latency: float, coalesced: int = 0):
+        # coalesced is the number of frames that were overwritten since the previous write
+        self.baseline = latency if self.baseline is None else min(self.baseline * 1.01, latency)
+        self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+        self.hold = max(self.hold - 1, 0)
+        if self.latency > self.baseline * self.tolerance + 0.002 or self.latency > self.interval:
+            # writes are queueing up or take longer than the frame interval, the link is saturated
+            self.backoff()
+        elif coalesced:
+            # the producer wants more than the current rate, probe for more. Without drops a higher rate would
+            # not be used and only climb towards max_rate untested
+            self.rate = min(self.rate + self.increase / self.rate, self.max_rate)
+
+    def on_error(self):
+        self.backoff()
+
+
+class DeviceStream:
+    def __init__(self, client: BleakClient, send, controller: RateController = None):
+        self.client = client
+        self.send = send
+        self.controller = controller
+        self.pending = None  # only the newest frame is kept, older unsent frames are dropped
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.errors = 0
+        self.task = None
+        address = getattr(client, 'address', None)
+        self.coalesced_counter = metrics.counter('stream_frames_coalesced_total', device=address)
+        self.flushed_counter = metrics.counter('stream_frames_flushed_total', device=address)
+
+    def flush(self):
+        self.ready.clear()
+        if self.pending is not None:
+            self.pending = None
+            self.flushed += 1
+            if metrics.enabled:
+                self.flushed_counter.inc()
+
+    def push(self, *frame):
+        if self.pending is not None:
+            self.dropped += 1
+            if metrics.enabled:
+                self.coalesced_counter.inc()
+        self.pending = frame
+        self.ready.set()
+
+    async def run(self):
+        mark = self.dropped  # frames dropped before the previous write
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            frame, self.pending = self.pending, None
+            if frame is None:
+                continue  # flushed after the wake-up
+            coalesced, mark = self.dropped - mark, self.dropped
+            start = time.monotonic()
+            try:
+                written = await self.send(self.client, *frame)
+                # False means the shadow skipped the write, it was not sent and says nothing about the link
+                if written is not False:
+                    self.sent += 1
+                    if self.controller is not None:
+                        self.controller.on_sent(time.monotonic() - start, coalesced)
+            except Exception:
+                self.errors += 1
+                if self.controller is not None:
+                    self.controller.on_error()
+            if self.controller is not None:
+                # pace the next write, frames pushed meanwhile are coalesced
+                await asyncio.sleep(max(start + self.controller.interval - time.monotonic(), 0))
+
+
+class StreamWriter:
+    def __init__(self, send, adaptive: bool = False):
+        self.send = send
+        self.adaptive = adaptive  # pace every device with its own RateController
+        self.streams: dict[BleakClient, DeviceStream] = {}
+
+    def stream(self, client: BleakClient) -> DeviceStream:
+        stream = self.streams.get(client)
+        if stream is None:
+            stream = DeviceStream(client, self.send, RateController() if self.adaptive else None)
+            stream.task = asyncio.create_task(stream.run())
+            self.streams[client] = stream
+            streams = getattr(client, 'streams', None)
+            if streams is not None:
+                streams.add(stream)
+        return stream
+
+    def push(self, client: BleakClient, *frame):
+        self.stream(client).push(*frame)
+
+    def push_all(self, clients: list[BleakClient], *frame):
+        for client in clients:
+            self.stream(client).push(*frame)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            stream.client.address: {'sent': stream.sent, 'dropped': stream.dropped, 'flushed': stream.flushed,
+                                    'errors': stream.errors,
+                                    'rate': None if stream.controller is None else stream.controller.rate}
+            for stream in self.streams.values()
+        }
+
+    async def close(self):
+        for stream in self.streams.values():
+            stream.task.cancel()
+            getattr(stream.client, 'streams', set()).discard(stream)
+        await asyncio.gather(*(stream.task for stream in self.streams.values()), return_exceptions=True)
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import codec
+from animation import hsv_to_rgb
+from audio import CHUNK_SIZE, SpectrumAnalyzer, Zone, ZoneMapper
+from beat import BeatDetector
+from registry import Registry
+from stream import StreamWriter
+
+HOP = CHUNK_SIZE // 2
+SEGMENT_FRAMES = 4096  # analysis frames per task, about 47 s of 44.1 kHz audio with the default hop
+SCALE = {1: 256.0, 2: 1.0, 4: 1 / 65536}  # brings every sample width to the int16 range the live analysis sees
+
+
+def open_wav(path: str) -> tuple[np.ndarray, int]:
+    # memory-maps the samples of a PCM WAV file as (frames, channels), nothing is read until it is used
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                offset = f.tell()
+                break
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                size -= 16
+            f.seek(size + (size & 1), 1)
+
+    if fmt is None:
+        raise ValueError(f"{path} has no format chunk")
+    encoding, channels, rate, _, block_align, bits = fmt
+    if encoding not in (1, 0xfffe) or bits not in (8, 16, 32):
+        raise ValueError(f"Unsupported WAV format in {path}: encoding {encoding}, {bits} bits")
+    # streamed WAVs leave the data size at its maximum, so the file size decides
+    frames = min(size, os.path.getsize(path) - offset) // block_align
+    dtype = {8: np.uint8, 16: '<i2', 32: '<i4'}[bits]
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels)), rate
+
+
+def to_mono(samples: np.ndarray) -> np.ndarray:
+    mono = samples.mean(axis=1)
+    if samples.dtype == np.uint8:
+        mono -= 128
+    return mono * SCALE[samples.dtype.itemsize]
+
+
+def analyze(path: str, start: int, count: int, window: int = CHUNK_SIZE, hop: int = HOP, zones: list = None) -> tuple:
+    # colors and spectral flux of the analysis frames start .. start + count, frame i covers the samples
+    # i * hop .. i * hop + window. The colors are (count, columns, 3), a column per zone or a single one with the
+    # bass/mids/highs colors when there are no zones. Runs in a worker process, so it opens the file itself.
+    samples, rate = open_wav(path)
+    analyzer = SpectrumAnalyzer(window, rate)
+    # the flux of a frame needs the spectrum of the one before it, and smoothed zones the frames of a few time
+    # constants before, so a segment starts the same way as if the file was analyzed in one go
+    warm = 1
+    if zones:
+        warm = max(warm, int(np.ceil(5 * max(zone.smoothing for zone in zones) * rate / hop)))
+    first = max(start - warm, 0)
+    mono = to_mono(samples[first * hop:(start + count - 1) * hop + window])
+    magnitude = analyzer.spectrum_batch(np.lib.stride_tricks.sliding_window_view(mono, window)[::hop])
+
+    log = np.log1p(magnitude[max(start - first - 1, 0):])
+    flux = np.maximum(np.diff(log, axis=0), 0).sum(axis=1)
+    if start == 0:
+        flux = np.concatenate([log[:1].sum(axis=1), flux])
+    if not zones:
+        return analyzer.bands_batch(magnitude[start - first:])[:, None, :], flux
+
+    mapper = ZoneMapper(zones, window, rate, hop / rate)
+    colors = np.empty((len(magnitude), len(zones), 3))
+    for i, spectrum in enumerate(magnitude):
+        colors[i] = mapper.update(spectrum)
+    return colors[start - first:], flux
+
+
+class Track:
+    def __init__(self, colors: np.ndarray, fps: float, start: float = 0.0, beats: np.ndarray = None,
+                 addresses: list[str] = ()):
+        self.colors = np.asarray(colors, dtype=np.uint8)  # (frames, columns, 3), one column when all strips match
+        self.fps = fps
+        self.start = start  # time in the audio of the first frame
+        self.beats = np.zeros(len(self.colors), dtype=bool) if beats is None else beats
+        self.addresses = list(addresses)  # strip of each column, empty when columns are assigned in order
+
+    @property
+    def duration(self) -> float:
+        return self.start + len(self.colors) / self.fps
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, colors=self.colors, beats=self.beats, fps=self.fps, start=self.start,
+                                addresses=np.array(self.addresses, dtype=str))
+
+    @classmethod
+    def load(cls, path: str) -> 'Track':
+        with np.load(path) as data:
+            return cls(data['colors'], float(data['fps']), float(data['start']), data['beats'],
+                       data['addresses'].tolist())
+
+    def encode(self, clients: list) -> np.ndarray:
+        # every frame of every client encoded up front, (frames, clients, FRAME_SIZE)
+        index = {address: i for i, address in enumerate(self.addresses)}
+        columns = [index.get(client.address, i % self.colors.shape[1]) for i, client in enumerate(clients)]
+        colors = self.colors[:, columns].reshape(-1, 3)
+        return codec.colors(colors).reshape(len(self.colors), len(clients), codec.FRAME_SIZE)
+
+
+def render(path: str, mode: str = 'spectrum', workers: int = None, window: int = CHUNK_SIZE, hop: int = HOP,
+           hue_step: float = 0.1, zones: list[Zone] = None, addresses: list[str] = ()) -> Track:
+    # with zones every strip in addresses gets a column of its own, the zone at the same position
+    if zones is not None and len(zones) != len(addresses):
+        raise ValueError(f"{len(zones)} zones for {len(addresses)} strips")
+    samples, rate = open_wav(path)
+    frames = max((len(samples) - window) // hop + 1, 0)
+    starts = list(range(0, frames, SEGMENT_FRAMES))
+    counts = [min(SEGMENT_FRAMES, frames - start) for start in starts]
+    args = ([path] * len(starts), starts, counts, [window] * len(starts), [hop] * len(starts),
+            [zones] * len(starts))
+    if workers == 1 or len(starts) <= 1:
+        results = list(map(analyze, *args))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(analyze, *args))
+    columns = len(zones) if zones else 1
+    rgb = np.concatenate([result[0] for result in results]) if results else np.zeros((0, columns, 3))
+    flux = np.concatenate([result[1] for result in results]) if results else np.zeros(0)
+
+    # onset picking depends on the frames before, so it runs in order over the precomputed flux
+    detector = BeatDetector(window // 2)
+    center = window / 2 / rate
+    beats = np.array([detector.detect(float(value), i * hop / rate + center) is not None
+                      for i, value in enumerate(flux)], dtype=bool)
+
+    if mode == 'beat':
+        # hold a color until the next beat, advancing the hue each time, dark until the first beat
+        count = np.cumsum(beats)
+        rgb = hsv_to_rgb(count * hue_step)
+        rgb[count == 0] = 0
+        # every strip flashes the same color
+        rgb = np.repeat(rgb[:, None, :], max(len(addresses), 1), axis=1)
+    elif mode != 'spectrum':
+        raise ValueError(f"Unknown render mode: {mode}")
+    elif zones is None and addresses:
+        rgb = np.repeat(rgb, len(addresses), axis=1)
+    return Track(rgb, rate / hop, center, beats, addresses)
+
+
+class AudioPlayback:
+    def __init__(self, path: str):
+        self.samples, self.rate = open_wav(path)
+        self.played = 0  # frames handed to the sound card
+        self.latency = 0.0
+        self.pyaudio = None
+        self.stream = None
+
+    def start(self):
+        import pyaudio  # only needed for local playback
+
+        def stream_callback(in_data, frame_count, time_info, status):
+            data = self.samples[self.played:self.played + frame_count]
+            self.played += len(data)
+            return data.tobytes(), pyaudio.paContinue if len(data) == frame_count else pyaudio.paComplete
+
+        formats = {1: pyaudio.paUInt8, 2: pyaudio.paInt16, 4: pyaudio.paInt32}
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = self.pyaudio.open(format=formats[self.samples.dtype.itemsize], channels=self.samples.shape[1],
+                                        rate=self.rate, output=True, stream_callback=stream_callback)
+        self.latency = self.stream.get_output_latency()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.pyaudio.terminate()
+            self.stream = None
+
+    def position(self) -> float:
+        # what is audible right now, the frames still in the output buffer have not been heard yet
+        return max(self.played / self.rate - self.latency, 0.0)
+
+
+class TrackPlayer:
+    def __init__(self, send, clients: list, track: Track, offset: float = 0.0, audio: AudioPlayback = None):
+        self.send = send  # async send(client, frame) with a pre-encoded frame, e.g. ELKDevice.stream
+        self.clients = list(clients)
+        self.track = track
+        self.offset = offset  # seconds the light runs ahead of the audio, covers the time a write takes to show
+        self.audio = audio
+        self.writer = None
+        self.played = 0
+        self.skipped = 0
+
+    async def run(self):
+        frames = self.track.encode(self.clients)
+        self.writer = StreamWriter(self.send, adaptive=True)
+        started = time.monotonic()
+        last = -1
+        if self.audio is not None:
+            self.audio.start()
+        try:
+            while True:
+                # the audio clock leads when there is local playback, so the lights follow its buffering
+                now = self.audio.position() if self.audio is not None else time.monotonic() - started
+                index = int((now + self.offset - self.track.start) * self.track.fps)
+                if index >= len(frames):
+                    break
+                if index > last and index >= 0:
+                    if last >= 0:
+                        self.skipped += index - last - 1
+                    for client, data in zip(self.clients, frames[index]):
+                        self.writer.push(client, data.tobytes())
+                    self.played += 1
+                    last = index
+                due = self.track.start - self.offset + (max(index, -1) + 1) / self.track.fps
+                await asyncio.sleep(max(due - now, 0.001))
+        finally:
+            if self.audio is not None:
+                self.audio.stop()
+            await self.writer.close()
+
+    def stats(self) -> dict:
+        devices = self.writer.stats() if self.writer is not None else {}
+        return {'played': self.played, 'skipped': self.skipped, 'devices': devices}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a WAV file into a light track for the play command.')
+    parser.add_argument('wav')
+    parser.add_argument('track', help='output file, a NumPy .npz archive')
+    parser.add_argument('--mode', choices=('spectrum', 'beat'), default='spectrum')
+    parser.add_argument('--workers', type=int, default=None, help='analysis processes, 1 to stay in this process')
+    parser.add_argument('--clients', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                          'clients.json'),
+                        help='a column per strip of this clients.json, with its zone')
+    args = parser.parse_args()
+
+    registry = Registry(args.clients)
+    addresses = registry.macs
+    zones = [Zone() if registry.zone(mac) is None else Zone.from_dict(registry.zone(mac)) for mac in addresses]
+    start = time.perf_counter()
+    track = render(args.wav, args.mode, args.workers, zones=zones, addresses=addresses)
+    track.save(args.track)
+    print(f"Rendered {len(track.colors)} frames at {track.fps:.1f} fps, {int(track.beats.sum())} beats, "
+          f"{track.duration:.1f} s of audio in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from animation import Animation, Chase, Gradient, Rainbow, Solid, Transition, fade
+
+
+@pytest.mark.parametrize('animation', [
+    Solid((255, 0, 0)),
+    Rainbow(),
+    Gradient([(255, 0, 0), (0, 0, 255)]),
+    Gradient([(255, 0, 0), (0, 255, 0), (0, 0, 255)], period=0),
+    Chase((255, 255, 255)),
+    Transition(Rainbow(), Solid((0, 0, 0))),
+    fade((0, 0, 0), (255, 255, 255)),
+])
+def test_render(animation):
+    positions = np.arange(5) / 5
+    out = np.zeros((5, 3))
+    for t in (0.0, 0.5, 3.0):
+        animation.render(t, positions, out)
+        assert np.isfinite(out).all()
+        assert out.min() >= 0 and out.max() <= 255
+
+
+def test_render_is_required():
+    class Incomplete(Animation):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from capture import SyntheticSource, ThreadSource
+
+
+def test_blocks_is_required():
+    class Incomplete(ThreadSource):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_synthetic_source_blocks():
+    source = SyntheticSource(duration=0.1)
+    blocks = list(source.blocks())
+    assert blocks and all(len(block) == source.block for block in blocks)
+    assert all(block.dtype == np.int16 for block in blocks)
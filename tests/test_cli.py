@@ -0,0 +1,109 @@
+import asyncio
+import io
+
+from main import CLI
+
+
+def run(cli, command: str) -> str:
+    out = io.StringIO()
+    asyncio.run(cli.process_command(command, out))
+    return out.getvalue()
+
+
+def test_clock_on_with_invalid_interval_prints_usage():
+    cli = CLI()
+    assert 'Usage: clock' in run(cli, 'clock on soon')
+    assert cli.clock.task is None
+
+
+def test_sync_on_with_invalid_window_prints_usage():
+    cli = CLI()
+    cli.device.synchronizer = None
+    assert 'Usage: sync' in run(cli, 'sync on 5ms')
+    assert cli.device.synchronizer is None
+
+
+def test_time_now_is_not_timed_by_the_synchronizer():
+    from clock import ClockSync
+    from emulator import Fleet
+    from presentation import Synchronizer
+
+    cli = CLI()
+    fleet = Fleet(2, latency=0.001, connect_latency=0.001)
+    cli.device = fleet.device()
+    cli.clock = ClockSync(cli.device, cli.registry, refresh=cli.refresh)
+
+    async def run():
+        await cli.device.connect()
+        cli.device.synchronizer = Synchronizer()
+        out = io.StringIO()
+        await cli.process_command('time now', out)
+        await cli.device.disconnect()
+        return out.getvalue()
+
+    assert asyncio.run(run()) == ''
+    assert cli.device.synchronizer.stats()['frames'] == 0
+    assert all(strip.time is not None for strip in fleet.strips.values())
+
+
+def test_record_into_a_missing_directory_prints_usage(tmp_path):
+    cli = CLI()
+    assert 'Usage: record' in run(cli, f"record start {tmp_path / 'missing' / 'session.elkrec'}")
+    assert cli.device.recorder is None
+
+
+def test_invalid_animation_keeps_the_running_one():
+    cli = CLI()
+
+    async def run():
+        out = io.StringIO()
+        await cli.process_command('animate rainbow', out)
+        running = cli.animation_task
+        await cli.process_command('animate chase 255 0 red', out)
+        await cli.process_command('animate fade 255 0 300', out)
+        kept = cli.animation_task is running and not running.done()
+        await cli.process_command('animate stop', out)
+        return out.getvalue(), kept
+
+    output, kept = asyncio.run(run())
+    assert output.count('Usage: animate') == 2
+    assert kept
+    assert cli.animation_task is None
+
+
+def connected_by(argv: list[str], monkeypatch) -> list[str] | None:
+    import main
+
+    connected = []
+
+    async def connect(self):
+        connected.append(list(self.device_address))
+        return []
+
+    async def disconnect(self):
+        return []
+
+    async def process_command(self, cmd, out=None):
+        pass
+
+    monkeypatch.setattr(main.CLI, 'device', main.ELKDevice())
+    monkeypatch.setattr(main.ELKDevice, 'connect', connect)
+    monkeypatch.setattr(main.ELKDevice, 'disconnect', disconnect)
+    monkeypatch.setattr(main.CLI, 'process_command', process_command)
+    assert asyncio.run(main.run_once(argv)) == 0
+    return connected[0] if connected else None
+
+
+def test_one_shot_connects_the_target_of_the_command(monkeypatch):
+    cli = CLI()
+    name = next(iter(cli.registry.by_name))
+    assert connected_by(['power', 'off', name], monkeypatch) == [cli.registry.by_name[name]]
+
+
+def test_one_shot_without_a_target_connects_every_known_strip(monkeypatch):
+    assert connected_by(['power', 'off'], monkeypatch) == CLI().registry.macs
+
+
+def test_one_shot_commands_without_strips_do_not_connect(monkeypatch):
+    for argv in (['stats'], ['status'], ['search']):
+        assert connected_by(argv, monkeypatch) is None
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import socket
+import stat
+
+import pytest
+
+from daemon import Daemon
+
+
+class CLI:
+    def __init__(self):
+        self.commands = []
+
+    async def process_command(self, cmd, out=None):
+        self.commands.append(cmd)
+        print(f"ran {cmd}", file=out)
+
+
+def request(daemon, line: bytes) -> dict:
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(line)
+        reader.feed_eof()
+        written = []
+
+        class Writer:
+            def write(self, data):
+                written.append(data)
+
+            async def drain(self):
+                pass
+
+            def close(self):
+                pass
+
+        await daemon.handle(reader, Writer())
+        return json.loads(b''.join(written))
+
+    return asyncio.run(run())
+
+
+def test_commands_must_be_a_list_of_strings():
+    daemon = Daemon(CLI())
+    for commands in ['power on', [['power', 'on']], [1], {'power': 'on'}]:
+        response = request(daemon, json.dumps({'commands': commands}).encode() + b'\n')
+        assert response['error'].startswith('Invalid request')
+    assert daemon.cli.commands == []
+
+
+def test_output_goes_to_the_response():
+    response = request(Daemon(CLI()), b'{"commands": ["power on", "color 255 0 0"]}\n')
+    assert [result['output'] for result in response['results']] == ["ran power on\n", "ran color 255 0 0\n"]
+
+
+def test_stale_socket_is_removed(tmp_path):
+    path = str(tmp_path / 'elkble.sock')
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(path)  # bound but not listening, like the socket of a daemon that died
+    asyncio.run(Daemon.claim(path))
+    assert not os.path.exists(path)
+
+
+def test_live_socket_is_kept(tmp_path):
+    path = str(tmp_path / 'elkble.sock')
+
+    async def run():
+        server = await asyncio.start_unix_server(lambda reader, writer: writer.close(), path)
+        async with server:
+            await Daemon.claim(path)
+
+    with pytest.raises(SystemExit):
+        asyncio.run(run())
+    assert os.path.exists(path)
+
+
+def test_socket_is_private(tmp_path):
+    path = str(tmp_path / 'elkble.sock')
+    daemon = Daemon(CLI())
+
+    async def run():
+        task = asyncio.create_task(daemon.serve(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return mode
+
+    assert asyncio.run(run()) == 0o600
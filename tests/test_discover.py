@@ -0,0 +1,25 @@
+import asyncio
+
+from emulator import Fleet
+
+
+def test_known_strip_without_a_name_ends_the_scan():
+    async def run():
+        fleet = Fleet(3, advertise_interval=0.01)
+        nameless = fleet.add('BE:59:00:00:01:00', name=None)
+        device = fleet.device(4)
+        found = [dev.address async for dev in device.discover({nameless.address}, timeout=5.0)]
+        return nameless.address, found
+
+    address, found = asyncio.run(run())
+    assert address in found
+
+
+def test_unknown_strip_without_a_name_is_ignored():
+    async def run():
+        fleet = Fleet(1, advertise_interval=0.01)
+        fleet.add('BE:59:00:00:01:00', name=None)
+        device = fleet.device(4)
+        return [dev.address async for dev in device.discover(timeout=0.2)]
+
+    assert asyncio.run(run()) == ['BE:59:00:00:00:00']
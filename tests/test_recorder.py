@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+
+import codec
+import recorder
+from elkble import ELKDevice, Priority
+from recorder import Outcome, Recorder
+
+ADDRESS = 'BE:59:00:00:00:00'
+
+
+def record(path: str, frames: list, start: float = 0.0):
+    rec = Recorder(path)
+    for i, frame in enumerate(frames):
+        rec.record(ADDRESS, frame, Priority.stream, start + i * 0.01, None)
+    rec.close()
+
+
+def test_a_new_session_replaces_the_old_one(tmp_path):
+    path = str(tmp_path / 'live.rec')
+    record(path, [codec.color(1, 2, 3)] * 3, start=1000.0)
+    record(path, [codec.color(4, 5, 6)] * 2, start=10.0)
+    records = recorder.read(path)
+    assert len(records) == 2
+    assert all(r.frame == codec.color(4, 5, 6) for r in records)
+
+
+def test_replay_sends_repeated_frames(tmp_path):
+    path = str(tmp_path / 'live.rec')
+    record(path, [codec.color(1, 2, 3)] * 5)
+    replayed = str(tmp_path / 'replayed.rec')
+    args = argparse.Namespace(recording=path, fake=True, latency=0.0, record=replayed, fast=True, speed=1.0)
+    assert asyncio.run(recorder.run_replay(args)) == 0
+    assert [r.outcome for r in recorder.read(replayed)] == [Outcome.ok] * 5
+
+
+def test_replay_device_has_its_own_lists():
+    first, second = ELKDevice(), ELKDevice()
+    first.add_address(ADDRESS)
+    assert second.device_address == [] and second.clients == [] and second.pool == {}
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from registry import Registry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / 'clients.json'
+    path.write_text(json.dumps({
+        'clients': [
+            {'id': 7, 'name': 'desk', 'mac': 'be:59:00:00:00:07', 'tags': ['office']},
+            {'id': 3, 'name': 'shelf', 'mac': 'BE:59:00:00:00:03'},
+        ],
+        'groups': {'all': ['office', 'shelf']},
+    }))
+    return Registry(str(path))
+
+
+def test_numbers_are_client_ids(registry):
+    assert registry.resolve('7') == ['BE:59:00:00:00:07']
+    assert registry.resolve('3') == ['BE:59:00:00:00:03']
+    assert registry.resolve('0') is None
+
+
+def test_names_groups_and_tags(registry):
+    assert registry.resolve('desk') == ['BE:59:00:00:00:07']
+    assert registry.resolve('office') == ['BE:59:00:00:00:07']
+    assert registry.resolve('all') == ['BE:59:00:00:00:07', 'BE:59:00:00:00:03']
+    assert registry.resolve('nobody') is None
+
+
+@pytest.mark.parametrize('zone', [
+    {'bands': [300, 2000], 'palette': [[255, 0, 0]]},
+    {'band': [300, 2000]},
+    {'palette': 'sunset'},
+])
+def test_invalid_zones_are_rejected_on_load(tmp_path, zone):
+    path = tmp_path / 'clients.json'
+    path.write_text(json.dumps({
+        'clients': [{'name': 'desk', 'mac': 'BE:59:00:00:00:07', 'zone': 'warm'},
+                    {'name': 'shelf', 'mac': 'BE:59:00:00:00:03', 'zone': {'palette': 'rainbow'}}],
+        'zones': {'warm': zone},
+    }))
+    with pytest.raises(ValueError, match='Invalid zone warm'):
+        Registry(str(path))
+
+
+def test_invalid_inline_zone_keeps_the_previous_config(registry):
+    config = json.loads(open(registry.path).read())
+    config['clients'][0]['zone'] = {'bands': [300], 'palette': 'rgb'}
+    with open(registry.path, 'w') as f:
+        json.dump(config, f)
+    registry.mtime = None  # as if the file had changed on disk
+    with pytest.raises(ValueError, match='Invalid zone desk'):
+        registry.refresh()
+    assert registry.resolve('desk') == ['BE:59:00:00:00:07']
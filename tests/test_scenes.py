@@ -0,0 +1,33 @@
+import asyncio
+
+import codec
+from emulator import Fleet
+from scenes import Plan
+
+
+def test_plan_reaches_every_strip_in_about_one_round_trip():
+    latency = 0.05
+
+    async def run():
+        fleet = Fleet(12, latency=latency, connect_latency=0.0)
+        device = fleet.device(concurrency=2)
+        await device.connect()
+        for strip in fleet.strips.values():
+            strip.power = True
+        plan = Plan()
+        addresses = [client.address for client in device.clients]
+        for frame in (codec.power(False), codec.color(255, 120, 0), codec.brightness(80)):
+            plan.add(addresses, frame)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await plan.apply(device)
+        elapsed = loop.time() - start
+        await device.disconnect()
+        return fleet, results, elapsed
+
+    fleet, results, elapsed = asyncio.run(run())
+    assert all(error is None for _, error in results)
+    assert elapsed < 2 * latency
+    for strip in fleet.strips.values():
+        assert strip.power is False
+        assert strip.color == (255, 120, 0) and strip.brightness == 80
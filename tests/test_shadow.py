@@ -0,0 +1,42 @@
+import asyncio
+
+import codec
+from elkble import CHARACTERISTIC_UUID, ELKDevice, ShadowClient
+from emulator import Fleet
+
+
+async def connect(fleet: Fleet) -> ShadowClient:
+    client = ShadowClient(fleet.client(next(iter(fleet.strips))))
+    await client.connect()
+    return client
+
+
+def test_control_commands_are_always_sent():
+    async def run():
+        fleet = Fleet(1, latency=0.0, connect_latency=0.0)
+        client = await connect(fleet)
+        for _ in range(2):
+            await ELKDevice.power_on(client)
+            await ELKDevice.set_color(client, 10, 20, 30)
+        return fleet, client
+
+    fleet, client = asyncio.run(run())
+    assert next(iter(fleet.strips.values())).frames == 4
+    assert client.suppressed == 0
+
+
+def test_unchanged_stream_frames_are_skipped():
+    async def run():
+        fleet = Fleet(1, latency=0.0, connect_latency=0.0)
+        client = await connect(fleet)
+        await ELKDevice.set_color(client, 10, 20, 30)
+        results = [await ELKDevice.stream(client, codec.color(12, 20, 30)),
+                   await ELKDevice.stream(client, codec.color(200, 20, 30))]
+        # written without stream=True it goes out even though it is the same
+        await client.write_gatt_char(CHARACTERISTIC_UUID, codec.color(200, 20, 30))
+        return fleet, client, results
+
+    fleet, client, results = asyncio.run(run())
+    assert results[0] is False and results[1] is not False
+    assert client.suppressed == 1
+    assert next(iter(fleet.strips.values())).frames == 3
@@ -0,0 +1,85 @@
+import asyncio
+
+from emulator import Fleet
+from stream import DeviceStream, RateController, StreamWriter
+
+
+class Client:
+    address = 'BE:59:00:00:00:00'
+
+
+def test_flush_with_pending_frame_is_not_an_error():
+    async def run():
+        sent = []
+
+        async def send(client, frame):
+            sent.append(frame)
+
+        stream = DeviceStream(Client(), send, RateController())
+        stream.push(b'first')
+        stream.flush()
+        stream.task = asyncio.create_task(stream.run())
+        await asyncio.sleep(0.05)
+        stream.task.cancel()
+        await asyncio.gather(stream.task, return_exceptions=True)
+        return stream, sent
+
+    stream, sent = asyncio.run(run())
+    assert sent == []
+    assert stream.flushed == 1
+    assert stream.errors == 0
+    assert stream.controller.rate == 20.0
+
+
+def test_rate_only_grows_while_frames_are_coalesced():
+    controller = RateController()
+    for _ in range(10):
+        controller.on_sent(0.01)
+    assert controller.rate == 20.0
+    for _ in range(10):
+        controller.on_sent(0.01, coalesced=1)
+    assert controller.rate > 20.0
+
+
+def test_saturated_link_backs_off_despite_demand():
+    controller = RateController()
+    controller.on_sent(0.01, coalesced=1)
+    rate = controller.rate
+    for _ in range(10):
+        controller.on_sent(0.2, coalesced=3)
+    assert controller.rate < rate
+
+
+def test_suppressed_frames_are_not_counted_as_sent():
+    async def run():
+        async def send(client, frame):
+            return False if frame == b'same' else None
+
+        stream = DeviceStream(Client(), send)
+        stream.task = asyncio.create_task(stream.run())
+        for frame in (b'new', b'same'):
+            stream.push(frame)
+            await asyncio.sleep(0.01)
+        stream.task.cancel()
+        await asyncio.gather(stream.task, return_exceptions=True)
+        return stream
+
+    assert asyncio.run(run()).sent == 1
+
+
+def test_stream_rate_is_collected_per_device():
+    async def run():
+        fleet = Fleet(2, latency=0.001, connect_latency=0.001)
+        device = fleet.device()
+        await device.connect()
+        client = device.clients[0]
+        writer = StreamWriter(device.stream_color, adaptive=True)
+        writer.push(client, 255, 0, 0)
+        await asyncio.sleep(0.01)
+        samples = [(labels['device'], value) for name, labels, _, value in device.collect() if name == 'stream_rate']
+        await writer.close()
+        await device.disconnect()
+        return client.address, samples
+
+    address, samples = asyncio.run(run())
+    assert samples == [(address, 20.0)]
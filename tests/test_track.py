@@ -0,0 +1,54 @@
+import wave
+
+import numpy as np
+import pytest
+
+import track
+from audio import Zone
+
+ADDRESSES = ['BE:59:00:00:00:00', 'BE:59:00:00:00:01', 'BE:59:00:00:00:02']
+
+
+@pytest.fixture
+def wav(tmp_path):
+    path = tmp_path / 'tone.wav'
+    t = np.arange(44100) / 44100
+    samples = (np.sin(2 * np.pi * 220 * t) * np.exp(-(t % 0.25) * 10) * 20000).astype('<i2')
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def zones() -> list[Zone]:
+    return [Zone(), Zone(palette=[[0, 0, 255], [0, 255, 0], [255, 0, 0]]), Zone(smoothing=0.1, gamma=2.0)]
+
+
+def test_render_has_a_column_per_strip(wav):
+    rendered = track.render(wav, workers=1, zones=zones(), addresses=ADDRESSES)
+    assert rendered.colors.shape[1] == len(ADDRESSES)
+    assert rendered.addresses == ADDRESSES
+    # different zones give different colors
+    assert not np.array_equal(rendered.colors[:, 0], rendered.colors[:, 1])
+
+
+def test_segments_match_one_pass(wav, monkeypatch):
+    whole = track.render(wav, workers=1, zones=zones(), addresses=ADDRESSES)
+    monkeypatch.setattr(track, 'SEGMENT_FRAMES', 16)
+    segmented = track.render(wav, workers=1, zones=zones(), addresses=ADDRESSES)
+    assert segmented.colors.shape == whole.colors.shape
+    assert np.abs(segmented.colors.astype(int) - whole.colors).max() <= 2
+    assert np.array_equal(segmented.beats, whole.beats)
+
+
+def test_beat_mode_and_plain_spectrum_fill_every_column(wav):
+    for mode, kwargs in (('beat', {'zones': zones()}), ('spectrum', {})):
+        rendered = track.render(wav, mode, workers=1, addresses=ADDRESSES, **kwargs)
+        assert rendered.colors.shape[1] == len(ADDRESSES)
+
+
+def test_zones_have_to_match_the_strips(wav):
+    with pytest.raises(ValueError):
+        track.render(wav, workers=1, zones=zones(), addresses=ADDRESSES[:1])